@@ -1,8 +1,15 @@
 import json
+from collections.abc import Mapping
 from datetime import date, datetime, time
 
 import dateutil
 
+try:
+    # orjson is an optional dependency used to speed up JSON parsing
+    import orjson
+except ImportError:
+    orjson = None
+
 populse_db_table = "populse_db"
 
 
@@ -105,6 +112,12 @@ def str_to_type(str):
     s = str.split("[", 1)
     if len(s) == 1:
         result = _str_to_type.get(s[0])
+        if result is None and s[0] == "ndarray":
+            # Import numpy only if required because it is an optional
+            # dependency
+            import numpy
+
+            result = numpy.ndarray
     else:
         args = tuple(str_to_type(i) for i in s[1][:-1].split(","))
         result = _str_to_type.get(s[0])
@@ -193,6 +206,20 @@ class DatabaseSession:
     def rollback(self):
         raise NotImplementedError()
 
+    def release(self, rollback=False):
+        """
+        Terminates the current transaction without closing the connection
+        to the database. The session can then be reused with :py:meth:`reset`.
+        """
+        raise NotImplementedError()
+
+    def reset(self, exclusive=False):
+        """
+        Starts a new transaction on a session terminated with
+        :py:meth:`release`.
+        """
+        raise NotImplementedError()
+
     def settings(self, category, key, default=None):
         raise NotImplementedError()
 
@@ -370,10 +397,7 @@ class DatabaseSession:
         if document_ids is None:
             yield from c.documents(fields=fields, as_list=as_list)
         else:
-            for document_id in document_ids:
-                document = c.get(document_id)
-                if document is not None:
-                    yield document
+            yield from c.documents_by_ids(document_ids, fields=fields, as_list=as_list)
 
     def remove_document(self, collection, document_id):
         """
@@ -401,10 +425,12 @@ class DatabaseSession:
 
 
 class DatabaseCollection:
-    def __init__(self, session, name):
+    def __init__(self, session, name, catchall_column=None):
         self.session = session
         self.name = name
-        self.catchall_column = self.settings().get("catchall_column", "_catchall")
+        if catchall_column is None:
+            catchall_column = self.settings().get("catchall_column", "_catchall")
+        self.catchall_column = catchall_column
         self.primary_key = {}
         self.bad_json_fields = set()
         self.fields = {}
@@ -430,7 +456,13 @@ class DatabaseCollection:
         self.set_settings(settings)
 
     def add_field(
-        self, name, field_type, description=None, index=False, bad_json=False
+        self,
+        name,
+        field_type,
+        description=None,
+        index=False,
+        bad_json=False,
+        packed=False,
     ):
         """
         Adds a field to the database
@@ -441,12 +473,22 @@ class DatabaseCollection:
 
         :param field_type: Field type, in ('string', 'int', 'float', 'boolean', 'date', 'datetime',
                      'time', 'json', 'list_string', 'list_int', 'list_float', 'list_boolean', 'list_date',
-                     'list_datetime', 'list_time', 'list_json')
+                     'list_datetime', 'list_time', 'list_json'). Type 'ndarray'
+                     (or numpy.ndarray) stores NumPy arrays as binary data with
+                     their dtype and shape. They are read as read-only arrays
+                     using the memory of the value returned by the database.
 
         :param description: Field description (str or None) => None by default
 
         :param index: Bool to know if indexing must be done => False by default
 
+        :param packed: Bool to store the values of a list[int] or list[float]
+                       field as a binary array of little-endian 64 bits numbers
+                       instead of JSON text => False by default. Packed fields
+                       can be used in filters like other list fields but they
+                       are converted to JSON for each document and cannot have
+                       an element index.
+
         :raise ValueError: - If the collection does not exist
                            - If the field already exists
                            - If the field name is invalid
@@ -468,18 +510,64 @@ class DatabaseCollection:
         """
         raise NotImplementedError()
 
+    def add_index(self, field):
+        """
+        Creates an index on a field. For a field that is not a column of
+        the collection (i.e. stored in catchall), the index is built on
+        the expression used in filters to get the field value. Therefore,
+        filters using this field can use the index.
+
+        :param field: Field name (str)
+
+        :raise ValueError: - If the field is not a column and the
+                             collection has no catchall column
+        """
+        raise NotImplementedError()
+
     def update_document(self, document_id, partial_document):
         raise NotImplementedError()
 
+    def update_documents(self, filter, partial_document):
+        """
+        Modifies all the documents selected by a filter
+
+        :param filter: Filter query (str) selecting the documents to modify
+
+        :param partial_document: dict containing the values to set
+
+        :return: the number of modified documents
+        """
+        raise NotImplementedError()
+
     def has_document(self, document_id):
         raise NotImplementedError()
 
-    def document(self, document_id, fields=None, as_list=False):
+    def document(self, document_id, fields=None, as_list=False, lazy=False):
         raise NotImplementedError()
 
-    def documents(self, fields=None, as_list=False):
+    def documents(
+        self, fields=None, as_list=False, distinct=False, as_columns=False, lazy=False
+    ):
         raise NotImplementedError()
 
+    def documents_by_ids(self, ids, fields=None, as_list=False):
+        """
+        Iterates over the documents whose primary key is in ids, in the
+        order of ids. Non existing documents are ignored. Engines should override this method
+        to get all documents with as few requests as possible.
+
+        :param ids: iterable of document identifiers
+
+        :param fields: List of fields to retrieve in the documents
+
+        :param as_list: If True, document values are returned in a list
+                        using fields order
+        """
+        for document_id in ids:
+            document = self.document(document_id, fields=fields, as_list=as_list)
+            if document is not None:
+                yield document
+
     def documents_ids(self):
         yield from (
             i for i in self.documents(fields=tuple(self.primary_key), as_list=True)
@@ -491,6 +579,19 @@ class DatabaseCollection:
     def add(self, document, replace=False):
         raise NotImplementedError()
 
+    def add_many(self, documents, replace=False):
+        """
+        Adds several documents. Engines should override this method to
+        insert documents in bulk.
+
+        :param documents: iterable of documents (dict)
+
+        :param replace: if True, existing documents with the same primary
+            key are replaced.
+        """
+        for document in documents:
+            self.add(document, replace=replace)
+
     def __setitem__(self, document_id, document):
         raise NotImplementedError()
 
@@ -523,7 +624,18 @@ class DatabaseCollection:
     def parse_filter(self, filter):
         raise NotImplementedError()
 
-    def filter(self, filter, fields=None, as_list=False):
+    def filter(
+        self,
+        filter,
+        fields=None,
+        as_list=False,
+        distinct=False,
+        as_columns=False,
+        lazy=False,
+        order_by=None,
+        limit=None,
+        after=None,
+    ):
         """
         Iterates over the collection documents selected by filter_query
 
@@ -544,6 +656,51 @@ class DatabaseCollection:
         :param as_list: If True, document values are returned in a list using
                         fields order
 
+        :param distinct: If True, duplicated documents are returned only once
+
+        :param as_columns: If True, return a dict whose keys are field names
+                           and values are NumPy arrays containing the values
+                           of all selected documents (requires numpy)
+
+        :param lazy: If True, documents are returned as
+                     :py:class:`LazyDocument` whose catchall fields are
+                     decoded only when accessed
+
+        :param order_by: Field name or list of field names used to sort
+                         documents. A name prefixed by "-" is sorted in
+                         descending order. Primary key fields are always
+                         added at the end of the sort key.
+
+        :param limit: Maximum number of documents to return
+
+        :param after: Keyset cursor used to get the next page of a sorted
+                      result: documents located after this cursor in the
+                      sort order are returned. It is either the last
+                      document of the previous page (it must contain sort
+                      and primary key fields) or a list of values for sort
+                      fields followed by primary key fields.
+
+        """
+        raise NotImplementedError()
+
+    def aggregate(self, filter=None, group_by=None, metrics=None):
+        """
+        Compute aggregate values on the documents selected by a filter
+        with a single request. Return a list containing one dict per
+        group of documents having the same values for group_by fields.
+        Each dict contains group_by field values and metric values.
+
+        :param filter: Filter query (str) or None to use all documents
+
+        :param group_by: Field name or list of field names used to group
+                         documents. If not given, a single group contains
+                         all selected documents.
+
+        :param metrics: dict whose keys are metric names and values are
+                        either "count" (number of documents) or a pair
+                        (function, field) where function is one of
+                        "count", "sum", "min", "max" or "avg". Default is
+                        {"count": "count"}.
         """
         raise NotImplementedError()
 
@@ -556,8 +713,39 @@ class DatabaseCollection:
         raise NotImplementedError()
 
 
-def json_dumps(value):
-    return json.dumps(value, separators=(",", ":"))
+# json.dumps() creates a new encoder for each call using non default
+# parameters. The most common case reuses a single encoder.
+_compact_json_encoder = json.JSONEncoder(separators=(",", ":"))
+
+
+def json_dumps(value, **kwargs):
+    if not kwargs:
+        return _compact_json_encoder.encode(value)
+    return json.dumps(value, separators=(",", ":"), **kwargs)
+
+
+# JSON is always written with json module because other libraries do not
+# produce the same text (e.g. escaping of non ASCII characters) and
+# databases must not depend on the installed JSON library. But it can be
+# parsed by any library returning the same values.
+if orjson is None:
+    json_loads = json.loads
+else:
+    # Translation table replacing digits by b"0" and other bytes by b" "
+    _digits_table = bytes(48 if 48 <= i <= 57 else 32 for i in range(256))
+    _long_number = b"0" * 19
+
+    def json_loads(text):
+        data = text.encode() if isinstance(text, str) else text
+        if _long_number in data.translate(_digits_table):
+            # orjson converts integers that do not fit in 64 bits to float
+            return json.loads(text)
+        try:
+            return orjson.loads(data)
+        except orjson.JSONDecodeError:
+            # orjson does not support some values written by json module
+            # such as NaN and Infinity.
+            return json.loads(text)
 
 
 _json_encodings = {
@@ -568,10 +756,50 @@ _json_encodings = {
     dict: lambda d: {k: json_encode(v) for k, v in d.items()},
 }
 
+
+def parse_datetime(value):
+    """
+    Converts a str (or bytes) to a datetime. Values written by populse_db
+    use isoformat() and are parsed with the fast datetime.fromisoformat().
+    Other strings are parsed with dateutil.
+    """
+    if isinstance(value, bytes):
+        value = value.decode()
+    try:
+        return datetime.fromisoformat(value)
+    except ValueError:
+        return dateutil.parser.parse(value)
+
+
+def parse_date(value):
+    """
+    Converts a str (or bytes) to a date. See :py:func:`parse_datetime`.
+    """
+    if isinstance(value, bytes):
+        value = value.decode()
+    try:
+        return date.fromisoformat(value)
+    except ValueError:
+        return dateutil.parser.parse(value).date()
+
+
+def parse_time(value):
+    """
+    Converts a str (or bytes) to a time without time zone. See
+    :py:func:`parse_datetime`.
+    """
+    if isinstance(value, bytes):
+        value = value.decode()
+    try:
+        return time.fromisoformat(value).replace(tzinfo=None)
+    except ValueError:
+        return dateutil.parser.parse(value).time()
+
+
 _json_decodings = {
-    "datetime": lambda s: dateutil.parser.parse(s),
-    "date": lambda s: dateutil.parser.parse(s).date(),
-    "time": lambda s: dateutil.parser.parse(s).time(),
+    "datetime": parse_datetime,
+    "date": parse_date,
+    "time": parse_time,
 }
 
 
@@ -604,6 +832,108 @@ def json_decode(value):
     return value
 
 
+def _json_default(value):
+    encode = _json_encodings.get(type(value))
+    if encode is None:
+        raise TypeError(
+            f"Object of type {type(value).__name__} is not JSON serializable"
+        )
+    return encode(value)
+
+
+def json_encode_dumps(value, **kwargs):
+    """
+    Equivalent to ``json.dumps(json_encode(value), **kwargs)`` but values
+    that must be tagged are converted by the JSON encoder itself. Therefore
+    the value is traversed only once.
+    """
+    return json.dumps(value, default=_json_default, **kwargs)
+
+
+def _decode_tagged(value):
+    # Dictionaries are not traversed because they are decoded by
+    # _json_object_hook
+    if isinstance(value, str):
+        if value.endswith("ℹ"):
+            return json_decode(value)
+    elif isinstance(value, list):
+        return [_decode_tagged(i) for i in value]
+    return value
+
+
+def _json_object_hook(d):
+    for k, v in d.items():
+        if isinstance(v, str | list):
+            d[k] = _decode_tagged(v)
+    return d
+
+
+def json_loads_decode(text):
+    """
+    Equivalent to ``json_decode(json.loads(text))``. If the JSON text
+    contains no tag character (either raw or escaped), there is no value
+    to decode and the result of json.loads() is returned directly.
+    Otherwise, dictionaries are decoded by json.loads() during parsing.
+    """
+    if "ℹ" not in text and "\\u2139" not in text:
+        return json_loads(text)
+    if orjson is not None:
+        # orjson has no object_hook but parsing then traversing the result
+        # is faster than json.loads() with object_hook.
+        return json_decode(json_loads(text))
+    return _decode_tagged(json.loads(text, object_hook=_json_object_hook))
+
+
+class LazyDocument(Mapping):
+    """
+    Read-only document returned by collections when lazy=True is used.
+    Values of the fields stored in columns are available immediately but
+    the catchall JSON text is parsed (with :py:func:`json_decode`) only
+    when another key is accessed or when all the keys are required (e.g.
+    for iteration or len()).
+    """
+
+    __slots__ = ("_catchall", "_columns", "_document")
+
+    def __init__(self, columns, catchall):
+        """
+        :param columns: dict containing the values of column fields
+
+        :param catchall: JSON text of catchall fields or None
+        """
+        self._columns = columns
+        self._catchall = catchall
+        self._document = None
+
+    def _decode(self):
+        if self._document is None:
+            if self._catchall is None:
+                document = {}
+            else:
+                document = json_loads_decode(self._catchall)
+            document.update(self._columns)
+            self._document = document
+        return self._document
+
+    def __getitem__(self, key):
+        try:
+            return self._columns[key]
+        except KeyError:
+            return self._decode()[key]
+
+    def __contains__(self, key):
+        return key in self._columns or key in self._decode()
+
+    def __iter__(self):
+        return iter(self._decode())
+
+    def __len__(self):
+        return len(self._decode())
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}({self._decode()!r})"
+
+
 # Obsolete constants kept for backward compatibility with API v2
 
 FIELD_TYPE_STRING = str
@@ -1,17 +1,29 @@
+import array
 import functools
 import json
 import os
 import sqlite3
+import sys
+import threading
+from collections import Counter, OrderedDict
+from collections.abc import Mapping
 from datetime import date, datetime, time
-
-import dateutil
+from time import perf_counter
+from typing import ClassVar
 
 from ..database import (
     DatabaseCollection,
     DatabaseSession,
+    LazyDocument,
     json_decode,
     json_dumps,
     json_encode,
+    json_encode_dumps,
+    json_loads,
+    json_loads_decode,
+    parse_date,
+    parse_datetime,
+    parse_time,
     populse_db_table,
     str_to_type,
     type_to_sqlite,
@@ -34,9 +46,9 @@ sqlite3.register_adapter(datetime, lambda d: d.isoformat())
 sqlite3.register_adapter(date, lambda d: d.isoformat())
 sqlite3.register_adapter(time, lambda d: d.isoformat())
 sqlite3.register_converter("bool", lambda b: bool(int(b)))
-sqlite3.register_converter("datetime", lambda b: dateutil.parser.parse(b))
-sqlite3.register_converter("date", lambda b: dateutil.parser.parse(b).date())
-sqlite3.register_converter("time", lambda b: dateutil.parser.parse(b).time())
+sqlite3.register_converter("datetime", parse_datetime)
+sqlite3.register_converter("date", parse_date)
+sqlite3.register_converter("time", parse_time)
 
 
 def create_sqlite_session_factory(url):
@@ -54,8 +66,452 @@ def sqlite_session_factory(sqlite_file, *args, create=False, **kwargs):
     return SQLiteSession(sqlite_file, *args, **kwargs)
 
 
+def _json_loads(value):
+    return None if value is None else json_loads(value)
+
+
+def _json_loads_decode(value):
+    return None if value is None else json_loads_decode(value)
+
+
+def _json_key_path(key):
+    """
+    Return the JSON path of a key of a JSON object. As in
+    SQLiteCollection.field_sql(), the key is quoted to allow any character
+    (e.g. dots or spaces). A double quote cannot be escaped in SQLite JSON
+    paths, therefore keys containing one are not quoted (which is only
+    possible if they do not contain "." or "[").
+    """
+    if '"' not in key:
+        return f'$."{key}"'
+    if "." not in key and "[" not in key:
+        return f"$.{key}"
+    raise ValueError(f"No JSON path can select the key {key!r}")
+
+
+def _compose(f, g):
+    return lambda value: f(g(value))
+
+
+def _row_decoder(fields, decoders, as_list, catchall, lazy):
+    """
+    Return a function converting a SELECT result row to a document (or
+    to a list if as_list is True). decoders is a list of (column index,
+    decode function) and catchall is True if the last column contains
+    the catchall JSON. If lazy is True, documents with a catchall are
+    returned as LazyDocument. Specialised functions are built to avoid
+    useless tests in the row loop.
+    """
+    if catchall and lazy:
+
+        def row_to_document(row):
+            row = list(row)
+            for index, decode in decoders:
+                row[index] = decode(row[index])
+            catchall = row.pop()
+            if catchall is not None and not catchall.startswith("{"):
+                # The whole document is a single value stored in
+                # catchall
+                return json_loads_decode(catchall)
+            return LazyDocument(dict(zip(fields, row, strict=False)), catchall)
+
+    elif catchall:
+
+        def row_to_document(row):
+            row = list(row)
+            for index, decode in decoders:
+                row[index] = decode(row[index])
+            catchall = row.pop()
+            if catchall is None:
+                document = {}
+            else:
+                document = json_loads_decode(catchall)
+                if not isinstance(document, dict):
+                    # The whole document is a single value stored in
+                    # catchall
+                    return document
+            document.update(zip(fields, row, strict=False))
+            return document
+
+    elif decoders:
+
+        def decode_row(row):
+            row = list(row)
+            for index, decode in decoders:
+                row[index] = decode(row[index])
+            return row
+
+        if as_list:
+            row_to_document = decode_row
+        else:
+
+            def row_to_document(row):
+                return dict(zip(fields, decode_row(row), strict=False))
+
+    elif as_list:
+        row_to_document = list
+    else:
+
+        def row_to_document(row):
+            return dict(zip(fields, row, strict=False))
+
+    return row_to_document
+
+
+# array module type codes used to store packed list fields. Items are
+# stored as little-endian 64 bits values.
+_packed_typecodes = {
+    int: "q",
+    float: "d",
+}
+
+
+def _packed_list_encoding(typecode):
+    """
+    Return the (encode, decode) functions converting a list to a BLOB
+    containing the packed values of its items and back.
+    """
+    swap = sys.byteorder != "little"
+
+    def encode(value):
+        if value is None:
+            return None
+        try:
+            packed = array.array(typecode, value)
+        except (TypeError, OverflowError) as e:
+            raise ValueError(f"cannot store {value!r} in a packed list field") from e
+        if swap:
+            packed.byteswap()
+        return packed.tobytes()
+
+    def decode(value):
+        if value is None:
+            return None
+        packed = array.array(typecode)
+        packed.frombytes(value)
+        if swap:
+            packed.byteswap()
+        return packed.tolist()
+
+    return encode, decode
+
+
+_packed_encodings = {
+    python_type: _packed_list_encoding(typecode)
+    for python_type, typecode in _packed_typecodes.items()
+}
+
+
+def _unpack_json(value, typecode):
+    """
+    SQL function returning the JSON text of a packed list. It is used to
+    give packed fields the same value as JSON list fields in filters.
+    """
+    if not isinstance(value, bytes):
+        return value
+    packed = array.array(typecode)
+    packed.frombytes(value)
+    if sys.byteorder != "little":
+        packed.byteswap()
+    return json_dumps(packed.tolist())
+
+
+def _ndarray_encode(value):
+    """
+    Convert a NumPy array to a BLOB containing a header followed by the
+    raw array data. The header is made of its size (2 bytes) and of a
+    JSON list containing dtype and shape. It is padded with spaces for
+    the data to be aligned on 16 bytes.
+    """
+    if value is None:
+        return None
+    import numpy
+
+    value = numpy.asarray(value, order="C")
+    if value.dtype.hasobject or value.dtype.fields is not None:
+        raise ValueError(
+            f"cannot store an array with dtype {value.dtype} in a ndarray field"
+        )
+    header = json_dumps([value.dtype.str, value.shape]).encode()
+    header += b" " * (-(len(header) + 2) % 16)
+    return b"".join((len(header).to_bytes(2, "little"), header, value.data))
+
+
+def _ndarray_decode(value):
+    """
+    Convert a BLOB created by _ndarray_encode() to a read-only NumPy array
+    using the BLOB memory (i.e. without copying the data).
+    """
+    if value is None:
+        return None
+    import numpy
+
+    size = int.from_bytes(value[:2], "little")
+    dtype, shape = json.loads(value[2 : 2 + size])
+    count = 1
+    for i in shape:
+        count *= i
+    return numpy.frombuffer(value, dtype=dtype, count=count, offset=2 + size).reshape(
+        shape
+    )
+
+
+# NumPy dtypes used for columns of the result of _columns()
+_numpy_dtypes = {
+    int: "int64",
+    float: "float64",
+    bool: "bool",
+    date: "datetime64[D]",
+    datetime: "datetime64[us]",
+}
+
+
 class ParsedFilter(str):
-    pass
+    """
+    SQL WHERE clause compiled from a filter. Values of literals used in the
+    filter are not in the SQL but in parameters.
+    """
+
+    parameters = ()
+    # Fields used in the filter that are stored in the catchall column
+    catchall_fields = ()
+    # (field, kind) for conditions that could use an index (see
+    # FilterToSQL.index_conditions)
+    index_conditions = ()
+
+
+class ParsedFilterCache:
+    """
+    Bounded LRU cache of filters compiled by
+    :py:meth:`SQLiteCollection.parse_filter`. It is shared by all sessions
+    of the process. Keys contain the collection name, the set of its
+    column fields and its element and text indexes, therefore a filter
+    compiled before a field or an index is added or removed is never
+    reused.
+
+    :py:attr:`hits` and :py:attr:`misses` count the lookups done since the
+    creation of the cache or the last call to :py:meth:`clear`.
+    """
+
+    def __init__(self, maxsize=1024):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            result = self._cache.get(key, self)
+            if result is self:
+                self.misses += 1
+                return default
+            self.hits += 1
+            self._cache.move_to_end(key)
+            return result
+
+    def set(self, key, parsed_filter):
+        with self._lock:
+            self._cache[key] = parsed_filter
+            self._cache.move_to_end(key)
+            while len(self._cache) > self.maxsize:
+                self._cache.popitem(last=False)
+
+    def invalidate(self, collection_name):
+        """
+        Remove all the filters compiled for a collection
+        """
+        with self._lock:
+            for key in [i for i in self._cache if i[0] == collection_name]:
+                del self._cache[key]
+
+    def clear(self):
+        with self._lock:
+            self._cache.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def info(self):
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "size": len(self._cache),
+            "maxsize": self.maxsize,
+        }
+
+
+parsed_filter_cache = ParsedFilterCache()
+
+# Prefix of the tables used internally (e.g. to index list elements).
+# New collections cannot use it but existing collections whose name starts
+# with this prefix are still listed.
+internal_table_prefix = f"{populse_db_table}_"
+
+# Suffixes of the shadow tables created by SQLite for an FTS5 table
+_fts5_shadow_tables = ("data", "idx", "content", "docsize", "config")
+
+
+def _element_table(collection, field):
+    """
+    Return the name of the table used to index the elements of a list
+    field (see SQLiteCollection.add_element_index()).
+    """
+    return f"{internal_table_prefix}elements_{collection}_{field}"
+
+
+def _text_table(collection, field):
+    """
+    Return the name of the FTS5 table used to index a str field (see
+    SQLiteCollection.add_text_index()).
+    """
+    return f"{internal_table_prefix}fts_{collection}_{field}"
+
+
+class WorkloadRecorder:
+    """
+    Records the SQL requests executed by the sessions whose workload
+    attribute is set to this recorder, with their number of executions
+    and the total time spent in SQLite (execution and rows fetching).
+    Compiled filters are also recorded with the fields they compare to
+    literal values. This information is used by
+    :py:meth:`SQLiteSession.advise_indexes` to propose indexes for slow
+    requests.
+
+    A recorder can be shared by several sessions:
+
+    ::
+
+        recorder = WorkloadRecorder()
+        with database as session:
+            session.workload = recorder
+            ...
+        with database as session:
+            print(session.advise_indexes(recorder))
+    """
+
+    def __init__(self, slow_threshold=0.01):
+        """
+        :param slow_threshold: requests whose mean execution time (in
+            seconds) is at least this value are considered as slow
+        """
+        self.slow_threshold = slow_threshold
+        # Keys are SQL requests and values are dict with "count",
+        # "time", "parameters" (of the first execution) and "plan"
+        # (result of EXPLAIN QUERY PLAN, set by advise_indexes()).
+        self.queries = {}
+        # Keys are (collection name, SQL of compiled filter) and values
+        # are conditions (see FilterToSQL.index_conditions)
+        self.filters = {}
+
+    def query(self, sql, parameters):
+        """
+        Record an execution of a request and return the dict containing
+        its statistics.
+        """
+        stats = self.queries.get(sql)
+        if stats is None:
+            stats = self.queries[sql] = {
+                "count": 0,
+                "time": 0.0,
+                "parameters": parameters,
+                "plan": None,
+            }
+        stats["count"] += 1
+        return stats
+
+    def add_filter(self, collection, parsed_filter):
+        self.filters[(collection, str(parsed_filter))] = parsed_filter.index_conditions
+
+    def slow_queries(self):
+        """
+        Return the statistics of slow requests.
+        """
+        return {
+            sql: stats
+            for sql, stats in self.queries.items()
+            if stats["time"] / stats["count"] >= self.slow_threshold
+        }
+
+    def clear(self):
+        self.queries = {}
+        self.filters = {}
+
+
+class _TimedCursor:
+    """
+    Proxy of an sqlite3 cursor adding the time spent to fetch rows to
+    the statistics of a WorkloadRecorder.
+    """
+
+    def __init__(self, cursor, stats):
+        self._cursor = cursor
+        self._stats = stats
+
+    def _timed(self, method, *args):
+        start = perf_counter()
+        try:
+            return method(*args)
+        finally:
+            self._stats["time"] += perf_counter() - start
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        return self._timed(self._cursor.__next__)
+
+    def fetchone(self):
+        return self._timed(self._cursor.fetchone)
+
+    def fetchmany(self, size=None):
+        if size is None:
+            return self._timed(self._cursor.fetchmany)
+        return self._timed(self._cursor.fetchmany, size)
+
+    def fetchall(self):
+        return self._timed(self._cursor.fetchall)
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+
+# Number of uses of catchall fields in filters and projections. Keys are
+# (absolute database file name, collection name) and values are Counter
+# instances shared by all sessions of the process. In-memory databases are
+# not shared, their usage is only counted by each collection instance.
+_catchall_usage = {}
+
+# Collections metadata shared by all sessions of the process. Keys are
+# absolute database file names and values are (version, collections)
+# pairs where version is returned by SQLiteSession._get_metadata_version()
+# and collections is a dict whose keys are collection names and values
+# are either the result of SQLiteCollection.metadata() or None if the
+# collection was not introspected yet.
+_metadata_cache = {}
+
+# Python types corresponding to the values returned by SQLite json_type()
+_json_types = {
+    "integer": int,
+    "real": float,
+    "text": str,
+    "true": bool,
+    "false": bool,
+    "array": list,
+    "object": dict,
+}
+
+
+def _json_types_to_type(json_types):
+    """
+    Return the Python type that can store values having all the given
+    json_type() results, or None if there is no such simple type.
+    """
+    types = {_json_types[i] for i in json_types if i != "null"}
+    if types == {int, float}:
+        return float
+    if len(types) == 1:
+        return types.pop()
+    return None
 
 
 class SQLiteSession(DatabaseSession):
@@ -63,8 +519,21 @@ class SQLiteSession(DatabaseSession):
         sqlite3.OperationalError,
         sqlite3.IntegrityError,
     )
+    # Size of the prepared statements cache of sqlite3 connections
+    cached_statements = 256
+    # WorkloadRecorder used to record executed requests or None
+    workload = None
 
-    def __init__(self, sqlite_file, exclusive=False, timeout=None, echo_sql=None):
+    def __init__(
+        self,
+        sqlite_file,
+        exclusive=False,
+        timeout=None,
+        echo_sql=None,
+        wal=False,
+        wal_autocheckpoint=None,
+    ):
+        self.sqlite_file = sqlite_file
         self.echo_sql = echo_sql
         if self.echo_sql:
             print(f"Connecting to {sqlite_file}", file=self.echo_sql, flush=True)
@@ -73,19 +542,122 @@ class SQLiteSession(DatabaseSession):
             isolation_level=None,
             check_same_thread=False,
             detect_types=sqlite3.PARSE_DECLTYPES,
+            cached_statements=self.cached_statements,
         )
         self.exclusive = exclusive
+        self.wal = wal
         if timeout:
             self.sqlite.execute(f"PRAGMA busy_timeout={timeout}")
+        if wal:
+            # With a write-ahead log, readers are never blocked by a writer
+            # and writers only have to lock other writers out.
+            self.sqlite.execute("PRAGMA journal_mode=WAL")
+            if wal_autocheckpoint is not None:
+                self.sqlite.execute(
+                    f"PRAGMA wal_autocheckpoint={int(wal_autocheckpoint)}"
+                )
+            self._begin = "IMMEDIATE" if exclusive else "DEFERRED"
+        else:
+            self._begin = "EXCLUSIVE" if exclusive else "DEFERRED"
+        self.sqlite.create_function(
+            "populse_db_unpack", 2, _unpack_json, deterministic=True
+        )
         self.sqlite.executescript(
             "PRAGMA synchronous=OFF;"
             "PRAGMA case_sensitive_like=ON;"
             "PRAGMA foreign_keys=ON;"
-            f"BEGIN {('EXCLUSIVE' if self.exclusive else 'DEFERRED')};"
+            # Documents replaced by INSERT OR REPLACE must fire delete
+            # triggers used to maintain index tables
+            "PRAGMA recursive_triggers=ON;"
+            f"BEGIN {self._begin};"
         )
-        self._collection_cache = {}
-        # Iterate on all collections to put them in cache
-        all(self)
+        self._load_collections()
+
+    def _get_metadata_version(self):
+        """
+        Return a value that changes whenever the schema or the settings of
+        the database are modified. PRAGMA schema_version covers all tables
+        modifications but settings can be modified without changing the
+        schema. Since settings are written with INSERT OR REPLACE, a
+        modification always creates a row with a new rowid.
+        """
+        schema_version = self.sqlite.execute("PRAGMA schema_version").fetchone()[0]
+        try:
+            settings_version = self.sqlite.execute(
+                f"SELECT max(rowid), count(*) FROM [{populse_db_table}]"
+            ).fetchone()
+        except sqlite3.OperationalError:
+            settings_version = None
+        return (schema_version, settings_version)
+
+    def _load_collections(self):
+        """
+        Initialize the cache of collections with the names of all the
+        collections. Collections are only introspected on first access.
+        Metadata of collections is shared with other sessions as long as
+        the version of the database metadata does not change.
+        """
+        self._metadata_version = self._get_metadata_version()
+        if self.sqlite_file and self.sqlite_file != ":memory:":
+            self._metadata_key = os.path.abspath(self.sqlite_file)
+        else:
+            self._metadata_key = None
+        cached = _metadata_cache.get(self._metadata_key)
+        if cached is None or cached[0] != self._metadata_version:
+            cached = (self._metadata_version, dict.fromkeys(self._collection_names()))
+            if self._metadata_key:
+                _metadata_cache[self._metadata_key] = cached
+        self._metadata = cached[1]
+        self._collection_cache = dict.fromkeys(self._metadata)
+
+    def _collection_names(self):
+        """
+        Return the names of the tables that are collections, that is all
+        tables except the settings table and the tables created to index
+        collections.
+        """
+        sql = "SELECT name FROM sqlite_master WHERE type='table'"
+        names = [row[0] for row in self.sqlite.execute(sql)]
+        if populse_db_table not in names or not any(
+            i.startswith(internal_table_prefix) for i in names
+        ):
+            return [i for i in names if i != populse_db_table]
+        internal_tables = {populse_db_table}
+        sql = f"SELECT key, _json FROM [{populse_db_table}] WHERE category='collection'"
+        for collection, settings in self.sqlite.execute(sql):
+            settings = json_loads(settings)
+            for field in settings.get("element_indexes", ()):
+                internal_tables.add(_element_table(collection, field))
+            for field in settings.get("text_indexes", ()):
+                table = _text_table(collection, field)
+                internal_tables.add(table)
+                internal_tables.update(f"{table}_{i}" for i in _fts5_shadow_tables)
+        return [i for i in names if i not in internal_tables]
+
+    def release(self, rollback=False):
+        if rollback:
+            self.sqlite.rollback()
+            # Collections cache may contain changes that were rolled back
+            self._metadata_version = None
+        else:
+            # The version read at the beginning of the transaction is kept.
+            # Reading it after the commit could return the version of
+            # modifications made by other connections that are not in the
+            # collections cache.
+            self.sqlite.commit()
+
+    def reset(self, exclusive=False):
+        self.exclusive = exclusive
+        if self.wal:
+            self._begin = "IMMEDIATE" if exclusive else "DEFERRED"
+        else:
+            self._begin = "EXCLUSIVE" if exclusive else "DEFERRED"
+        self.sqlite.execute(f"BEGIN {self._begin}")
+        # Collections are reloaded only if the schema or the settings were
+        # modified since the session was released (for instance by another
+        # process).
+        if self._get_metadata_version() != self._metadata_version:
+            self._load_collections()
 
     def close(self, rollback=False):
         if rollback:
@@ -104,17 +676,31 @@ class SQLiteSession(DatabaseSession):
         return name in self._collection_cache
 
     def get_collection(self, name):
-        return self._collection_cache.get(name)
+        if name in self._collection_cache:
+            return self[name]
+        return None
 
     def __getitem__(self, collection_name):
         result = self._collection_cache.get(collection_name)
         if result is None:
-            result = SQLiteCollection(self, collection_name)
+            metadata = self._metadata.get(collection_name)
+            result = SQLiteCollection(self, collection_name, metadata=metadata)
             self._collection_cache[collection_name] = result
+            # Metadata is shared only if the collection was read from the
+            # database state that was seen at the beginning of the session
+            # (i.e. if there is no uncommitted modification).
+            if (
+                metadata is None
+                and collection_name in self._metadata
+                and self._get_metadata_version() == self._metadata_version
+            ):
+                self._metadata[collection_name] = result.metadata()
         return result
 
     def execute(self, sql, data=None):
         try:
+            if self.workload is not None:
+                return self._recorded_execute(sql, data)
             if data:
                 result = self.sqlite.execute(sql, data)
                 if self.echo_sql:
@@ -128,13 +714,151 @@ class SQLiteSession(DatabaseSession):
         except sqlite3.OperationalError as e:
             raise sqlite3.OperationalError(f"Error in SQL request: {sql}") from e
 
+    def _recorded_execute(self, sql, data):
+        stats = self.workload.query(sql, data)
+        start = perf_counter()
+        if data:
+            result = self.sqlite.execute(sql, data)
+        else:
+            result = self.sqlite.execute(sql)
+        stats["time"] += perf_counter() - start
+        if self.echo_sql:
+            print(sql, data, file=self.echo_sql, flush=True)
+        if result.description is None:
+            return result
+        return _TimedCursor(result, stats)
+
+    def advise_indexes(self, recorder=None):
+        """
+        Propose indexes for the slow requests recorded by a
+        WorkloadRecorder (by default the one of this session). The query
+        plan of each slow request is computed with EXPLAIN QUERY PLAN.
+        For requests scanning a whole table, an index is proposed on the
+        fields compared to literal values in the filter: fields tested for
+        equality followed by at most one field used in a range condition.
+        This is a single column index, a composite index if there are
+        several fields, or an expression index for fields stored in the
+        catchall column.
+
+        Return a list of dict sorted by decreasing estimated benefit. Each
+        dict contains "collection", "fields", "kind" ("single",
+        "composite" or "expression"), "sql" (the CREATE INDEX request,
+        which is the one of SQLiteCollection.add_index() for a single field
+        index; this method should be used to create such indexes in order
+        to record them in collection settings),
+        "queries" (number of executions of the requests that could use
+        the index) and "benefit" (time in seconds spent in these requests,
+        that is the upper bound of the time that could be saved).
+        """
+        if recorder is None:
+            recorder = self.workload
+        if recorder is None:
+            raise ValueError("No workload recorder available")
+        advice = {}
+        for sql, stats in recorder.slow_queries().items():
+            if stats["plan"] is None:
+                try:
+                    stats["plan"] = [
+                        row[-1]
+                        for row in self.sqlite.execute(
+                            f"EXPLAIN QUERY PLAN {sql}", stats["parameters"] or ()
+                        )
+                    ]
+                except sqlite3.Error:
+                    stats["plan"] = []
+            for (collection_name, where), conditions in recorder.filters.items():
+                if (
+                    not conditions
+                    or where not in sql
+                    or f"FROM [{collection_name}]" not in sql
+                    or not any(
+                        line == f"SCAN {collection_name}"
+                        or line.startswith(f"SCAN {collection_name} ")
+                        for line in stats["plan"]
+                    )
+                ):
+                    continue
+                collection = self.get_collection(collection_name)
+                if collection is None:
+                    # Collection removed after the request was recorded
+                    continue
+                fields = []
+                for field, kind in conditions:
+                    if kind == "eq" and field not in fields:
+                        fields.append(field)
+                for field, kind in conditions:
+                    if kind == "range" and field not in fields:
+                        fields.append(field)
+                        break
+                if not fields:
+                    continue
+                key = (collection_name, tuple(fields))
+                item = advice.get(key)
+                if item is None:
+                    expression = any(i not in collection.fields for i in fields)
+                    if len(fields) > 1:
+                        kind = "composite"
+                    elif expression:
+                        kind = "expression"
+                    else:
+                        kind = "single"
+                    if len(fields) == 1:
+                        sql = collection._index_sql(fields[0])
+                    else:
+                        sql = (
+                            f"CREATE INDEX IF NOT EXISTS "
+                            f"[{collection_name}_{'_'.join(fields)}] "
+                            f"ON [{collection_name}] "
+                            f"({','.join(collection.field_sql(i) for i in fields)})"
+                        )
+                    item = advice[key] = {
+                        "collection": collection_name,
+                        "fields": fields,
+                        "kind": kind,
+                        "sql": sql,
+                        "queries": 0,
+                        "benefit": 0.0,
+                    }
+                item["queries"] += stats["count"]
+                item["benefit"] += stats["time"]
+        return sorted(advice.values(), key=lambda i: i["benefit"], reverse=True)
+
+    def executemany(self, sql, data):
+        try:
+            result = self.sqlite.executemany(sql, data)
+            if self.echo_sql:
+                print(sql, f"<{len(data)} rows>", file=self.echo_sql, flush=True)
+            return result
+        except sqlite3.OperationalError as e:
+            raise sqlite3.OperationalError(f"Error in SQL request: {sql}") from e
+
     def commit(self):
         self.sqlite.commit()
-        self.sqlite.execute(f"BEGIN {('EXCLUSIVE' if self.exclusive else 'DEFERRED')}")
+        self.sqlite.execute(f"BEGIN {self._begin}")
 
     def rollback(self):
         self.sqlite.rollback()
-        self.sqlite.execute(f"BEGIN {('EXCLUSIVE' if self.exclusive else 'DEFERRED')}")
+        self.sqlite.execute(f"BEGIN {self._begin}")
+
+    def checkpoint(self, mode="PASSIVE"):
+        """
+        Commit the current transaction and copy the content of the
+        write-ahead log into the database file. mode can be "PASSIVE",
+        "FULL", "RESTART" or "TRUNCATE" (see SQLite documentation of
+        wal_checkpoint pragma). Returns a (busy, log, checkpointed) tuple
+        where busy is 1 if the checkpoint could not complete, log is the
+        number of pages in the log and checkpointed the number of pages
+        copied in the database file.
+        """
+        mode = mode.upper()
+        if mode not in ("PASSIVE", "FULL", "RESTART", "TRUNCATE"):
+            raise ValueError(f"invalid checkpoint mode: {mode}")
+        self.sqlite.commit()
+        try:
+            result = self.sqlite.execute(f"PRAGMA wal_checkpoint({mode})").fetchone()
+        finally:
+            self.sqlite.execute(f"BEGIN {self._begin}")
+        return tuple(result)
 
     def settings(self, category, key, default=None):
         try:
@@ -144,7 +868,7 @@ class SQLiteSession(DatabaseSession):
             return default
         j = cur.fetchone()
         if j:
-            return json.loads(j[0])
+            return json_loads(j[0])
         return default
 
     def set_settings(self, category, key, value):
@@ -174,11 +898,16 @@ class SQLiteSession(DatabaseSession):
         sql = 'SELECT name FROM sqlite_master WHERE type = "table"'
         if keep_settings:
             sql += f" AND name != '{populse_db_table}'"
+        # Virtual tables are dropped first because this also drops their
+        # shadow tables.
+        sql += " ORDER BY sql LIKE 'CREATE VIRTUAL TABLE%' DESC"
         tables = [i[0] for i in self.execute(sql)]
         for table in tables:
-            sql = f"DROP TABLE [{table}]"
+            sql = f"DROP TABLE IF EXISTS [{table}]"
             self.execute(sql)
         self._collection_cache = {}
+        # Shared metadata must not be used for new tables with same names
+        self._metadata = {}
 
     def add_collection(
         self,
@@ -186,6 +915,10 @@ class SQLiteSession(DatabaseSession):
         primary_key=DatabaseSession.default_primary_key,
         catchall_column="_catchall",
     ):
+        if name.startswith(internal_table_prefix):
+            raise ValueError(
+                f'Collection name "{name}" cannot start with "{internal_table_prefix}"'
+            )
         if isinstance(primary_key, str):
             dict_primary_key = {primary_key: "str"}
         elif isinstance(primary_key, list | tuple):
@@ -210,33 +943,105 @@ class SQLiteSession(DatabaseSession):
         self[name]
 
     def remove_collection(self, name):
+        collection = self.get_collection(name)
+        if collection is not None:
+            for field in list(collection.element_indexes):
+                collection.remove_element_index(field)
+            for field in list(collection.text_indexes):
+                collection.remove_text_index(field)
         sql = f"DROP TABLE [{name}]"
         self.execute(sql)
         self._collection_cache.pop(name, None)
+        # Shared metadata must not be used for new tables with same names
+        self._metadata = {}
 
     def __iter__(self):
-        sql = "SELECT name FROM sqlite_master WHERE type='table'"
-        for row in self.execute(sql):
-            table = row[0]
-            if table == populse_db_table:
-                continue
-            yield self[table]
+        for name in self._collection_names():
+            yield self[name]
 
 
 class SQLiteCollection(DatabaseCollection):
+    # Maximum number of documents sent to executemany() by add_many()
+    add_many_batch_size = 10000
+    # Above this number of keys, documents_by_ids() sends all keys in a
+    # single JSON array parameter read with json_each() instead of using
+    # one SQL parameter per key value.
+    documents_by_ids_in_limit = 500
+
+    # Default minimum number of uses in filters and projections for
+    # promote_catchall_fields() to move a catchall field to a column.
+    catchall_promotion_threshold = 1000
+
+    # Number of rows modified by each UPDATE request when the values of a
+    # field are moved from catchall to a column.
+    promotion_batch_size = 10000
+
     _column_encodings = {
         list: (
             lambda l: (None if l is None else json_dumps(l)),  # noqa: E741
-            lambda l: (None if l is None else json.loads(l)),  # noqa: E741
+            lambda l: (None if l is None else json_loads(l)),  # noqa: E741
         ),
         dict: (
             lambda d: (None if d is None else json_dumps(d)),
-            lambda d: (None if d is None else json.loads(d)),
+            lambda d: (None if d is None else json_loads(d)),
         ),
     }
 
-    def __init__(self, session, name):
-        super().__init__(session, name)
+    @classmethod
+    def _column_encoding(cls, main_type):
+        """
+        Return the (encode, decode) functions used to store values of the
+        given type in a column or None if values are stored as is.
+        """
+        encoding = cls._column_encodings.get(main_type)
+        if encoding is None:
+            # numpy is imported if a field has ndarray type
+            numpy = sys.modules.get("numpy")
+            if numpy is not None and main_type is numpy.ndarray:
+                encoding = (_ndarray_encode, _ndarray_decode)
+        return encoding
+
+    def __init__(self, session, name, metadata=None):
+        # Cache of SQL requests built from the table columns. Reusing the
+        # same SQL string also allows sqlite3 module to reuse its prepared
+        # statement.
+        self._sql_cache = {}
+        if session._metadata_key:
+            self.catchall_usage = _catchall_usage.setdefault(
+                (session._metadata_key, name), Counter()
+            )
+        else:
+            self.catchall_usage = Counter()
+        if metadata is None:
+            super().__init__(session, name)
+            self._introspect()
+        else:
+            # Giving the catchall column avoids reading collection settings
+            super().__init__(session, name, catchall_column=metadata["catchall_column"])
+            self.primary_key = dict(metadata["primary_key"])
+            self.bad_json_fields = set(metadata["bad_json_fields"])
+            self.fields = {k: dict(v) for k, v in metadata["fields"].items()}
+            self.catchall_indexes = set(metadata["catchall_indexes"])
+            self.element_indexes = set(metadata["element_indexes"])
+            self.text_indexes = dict(metadata["text_indexes"])
+
+    def metadata(self):
+        """
+        Return a copy of the collection definition read from the database
+        that can be given to the constructor to avoid introspection.
+        """
+        return {
+            "catchall_column": self.catchall_column,
+            "primary_key": dict(self.primary_key),
+            "bad_json_fields": set(self.bad_json_fields),
+            "fields": {k: dict(v) for k, v in self.fields.items()},
+            "catchall_indexes": set(self.catchall_indexes),
+            "element_indexes": set(self.element_indexes),
+            "text_indexes": dict(self.text_indexes),
+        }
+
+    def _introspect(self):
+        name = self.name
         settings = self.session.settings("collection", name, {})
         sql = f"pragma table_info([{self.name}])"
         bad_table = True
@@ -249,7 +1054,7 @@ class SQLiteCollection(DatabaseCollection):
             column_type_str = row[2].lower()
             column_type = str_to_type(column_type_str)
             main_type = getattr(column_type, "__origin__", None) or column_type
-            encoding = self._column_encodings.get(main_type)
+            encoding = self._column_encoding(main_type)
             if row[5]:
                 self.primary_key[row[1]] = column_type
             field = {
@@ -261,6 +1066,8 @@ class SQLiteCollection(DatabaseCollection):
             }
             field_settings = settings.get("fields", {}).get(row[1], {})
             field.update(field_settings)
+            if field_settings.get("packed", False):
+                field["encoding"] = _packed_encodings[column_type.__args__[0]]
             if field_settings.get("bad_json", False):
                 self.bad_json_fields.add(row[1])
             self.fields[row[1]] = field
@@ -268,39 +1075,60 @@ class SQLiteCollection(DatabaseCollection):
             raise ValueError(f"No such database table: {name}")
         if self.catchall_column and not catchall_column_found:
             raise ValueError(f"table {name} must have a column {self.catchall_column}")
+        self.catchall_indexes = set(settings.get("catchall_indexes", ()))
+        self.element_indexes = set(settings.get("element_indexes", ()))
+        self.text_indexes = settings.get("text_indexes", {})
 
     def add_field(
-        self, name, field_type, description=None, index=False, bad_json=False
+        self,
+        name,
+        field_type,
+        description=None,
+        index=False,
+        bad_json=False,
+        packed=False,
     ):
         if isinstance(field_type, str):
             field_type = str_to_type(field_type)
+        if packed:
+            if getattr(field_type, "__origin__", None) is not list or (
+                field_type.__args__[0] not in _packed_typecodes
+            ):
+                raise ValueError(
+                    f"packed field {name} must have list[int] or list[float] type"
+                )
+            encoding = _packed_encodings[field_type.__args__[0]]
+        else:
+            encoding = self._column_encoding(
+                getattr(field_type, "__origin__", None) or field_type
+            )
         sql = f"ALTER TABLE [{self.name}] ADD COLUMN [{name}] {type_to_sqlite(field_type)}"
         self.session.execute(sql)
         if index:
             sql = f"CREATE INDEX [{self.name}_{name}] ON [{self.name}] ([{name}])"
             self.session.execute(sql)
         settings = self.settings()
-        settings.setdefault("fields", {})[name] = {
+        field_settings = {
             "description": description,
             "index": index,
             "bad_json": bad_json,
         }
+        if packed:
+            field_settings["packed"] = True
+        settings.setdefault("fields", {})[name] = field_settings
         self.set_settings(settings)
         field = {
             "collection": self.name,
             "name": name,
             "primary_key": False,
             "type": field_type,
-            "description": description,
-            "index": index,
-            "bad_json": bad_json,
-            "encoding": self._column_encodings.get(
-                getattr(field_type, "__origin__", None) or field_type
-            ),
+            "encoding": encoding,
+            **field_settings,
         }
         self.fields[name] = field
         if bad_json:
             self.bad_json_fields.add(name)
+        self._clear_sql_cache()
 
     def remove_field(self, name):
         """
@@ -318,6 +1146,10 @@ class SQLiteCollection(DatabaseCollection):
         if name in self.primary_key:
             raise ValueError("Cannot remove a key field")
 
+        if name in self.element_indexes:
+            self.remove_element_index(name)
+        if name in self.text_indexes:
+            self.remove_text_index(name)
         sql = f"ALTER TABLE [{self.name}] DROP COLUMN [{name}]"
         self.session.execute(sql)
         # Update metadata
@@ -327,25 +1159,385 @@ class SQLiteCollection(DatabaseCollection):
         self.set_settings(settings)
         self.fields.pop(name, None)
         self.bad_json_fields.discard(name)
+        self._clear_sql_cache()
+
+    def _index_sql(self, field):
+        """
+        Return the CREATE INDEX request used by add_index() for a field.
+        """
+        if field in self.fields:
+            return f"CREATE INDEX IF NOT EXISTS [{self.name}_{field}] ON [{self.name}] ([{field}])"
+        # The index expression must be exactly the one used in filters
+        # otherwise SQLite does not use the index.
+        return (
+            f"CREATE INDEX IF NOT EXISTS [{self.name}_{self.catchall_column}_{field}] "
+            f"ON [{self.name}] ({self.field_sql(field)})"
+        )
+
+    def add_index(self, field):
+        settings = self.settings()
+        if field in self.fields:
+            self.session.execute(self._index_sql(field))
+            settings.setdefault("fields", {}).setdefault(field, {})["index"] = True
+            self.fields[field]["index"] = True
+        elif self.catchall_column:
+            self.session.execute(self._index_sql(field))
+            self.catchall_indexes.add(field)
+            settings["catchall_indexes"] = sorted(self.catchall_indexes)
+        else:
+            raise ValueError(
+                f'Cannot index unknown field "{field}" in collection "{self.name}"'
+            )
+        self.set_settings(settings)
+
+    def _element_table(self, field):
+        return _element_table(self.name, field)
+
+    def add_element_index(self, field):
+        """
+        Create an index on the elements of a list field. Elements are
+        stored with the primary key of their document in a table that is
+        maintained by triggers when documents are inserted, modified or
+        deleted. Filters using the ``value IN {field}`` condition then
+        use an indexed search in this table instead of parsing the JSON
+        of the list of every document.
+
+        :param field: Name of a list field
+        """
+        field_info = self.fields.get(field)
+        field_type = field_info and field_info["type"]
+        if (getattr(field_type, "__origin__", None) or field_type) is not list:
+            raise ValueError(
+                f'Field "{field}" of collection "{self.name}" is not a list field'
+            )
+        if field_info.get("packed"):
+            raise ValueError(
+                f'Packed field "{field}" of collection "{self.name}" cannot have an element index'
+            )
+        if field in self.element_indexes:
+            return
+        table = self._element_table(field)
+        primary_key = ",".join(f"[{i}]" for i in self.primary_key)
+        new_primary_key = ",".join(f"NEW.[{i}]" for i in self.primary_key)
+        self.session.execute(
+            f"CREATE TABLE [{table}] (element,"
+            f"{','.join(f'[{i}] NOT NULL' for i in self.primary_key)},"
+            f"PRIMARY KEY (element,{primary_key})) WITHOUT ROWID"
+        )
+        insert = (
+            f"INSERT OR IGNORE INTO [{table}] "
+            f"SELECT value,{new_primary_key} FROM json_each(NEW.[{field}]);"
+        )
+
+        def delete(row):
+            where = " AND ".join(f"[{i}]={row}.[{i}]" for i in self.primary_key)
+            return f"DELETE FROM [{table}] WHERE {where};"
+
+        # Elements of a document replaced by INSERT OR REPLACE are removed
+        # by the delete trigger because recursive_triggers is enabled.
+        self.session.execute(
+            f"CREATE TRIGGER [{table}_insert] AFTER INSERT ON [{self.name}] "
+            f"BEGIN {insert} END"
+        )
+        self.session.execute(
+            f"CREATE TRIGGER [{table}_update] "
+            f"AFTER UPDATE OF [{field}],{primary_key} ON [{self.name}] "
+            f"BEGIN {delete('OLD')} {insert} END"
+        )
+        self.session.execute(
+            f"CREATE TRIGGER [{table}_delete] AFTER DELETE ON [{self.name}] "
+            f"BEGIN {delete('OLD')} END"
+        )
+        self.session.execute(
+            f"INSERT OR IGNORE INTO [{table}] SELECT json_each.value,"
+            f"{','.join(f'[{self.name}].[{i}]' for i in self.primary_key)} "
+            f"FROM [{self.name}], json_each([{self.name}].[{field}])"
+        )
+        self.element_indexes.add(field)
+        settings = self.settings()
+        settings["element_indexes"] = sorted(self.element_indexes)
+        self.set_settings(settings)
+        self._clear_sql_cache()
+
+    def remove_element_index(self, field):
+        """
+        Remove the index created by :py:meth:`add_element_index`.
+        """
+        if field not in self.element_indexes:
+            return
+        table = self._element_table(field)
+        for trigger in ("insert", "update", "delete"):
+            self.session.execute(f"DROP TRIGGER IF EXISTS [{table}_{trigger}]")
+        self.session.execute(f"DROP TABLE IF EXISTS [{table}]")
+        self.element_indexes.discard(field)
+        settings = self.settings()
+        settings["element_indexes"] = sorted(self.element_indexes)
+        self.set_settings(settings)
+        self._clear_sql_cache()
+
+    def element_index_condition(self, field, value_sql):
+        """
+        Return an SQL condition selecting documents whose list field
+        contains a value using the table created by
+        :py:meth:`add_element_index`.
+        """
+        primary_key = ",".join(f"[{i}]" for i in self.primary_key)
+        return (
+            f"({primary_key}) IN (SELECT {primary_key} "
+            f"FROM [{self._element_table(field)}] WHERE element={value_sql})"
+        )
+
+    def _text_table(self, field):
+        return _text_table(self.name, field)
+
+    def add_text_index(self, field, tokenizer="trigram"):
+        """
+        Create an SQLite FTS5 full text index on a str field. The index is
+        a virtual table using the collection table as external content and
+        maintained by triggers. It is used by the MATCH filter operator
+        (e.g. ``{field} MATCH "text"``) whose right operand is searched as
+        a single FTS5 phrase. With the default trigram tokenizer,
+        ``MATCH "text"`` selects values containing "text" (ignoring case
+        and only if the searched text has at least three characters).
+
+        :param field: Name of a str field
+
+        :param tokenizer: FTS5 tokenizer definition (e.g. "trigram" or
+            "unicode61 remove_diacritics 2")
+        """
+        field_info = self.fields.get(field)
+        if field_info is None or field_info["type"] is not str:
+            raise ValueError(
+                f'Field "{field}" of collection "{self.name}" is not a str field'
+            )
+        if field in self.text_indexes:
+            return
+        table = self._text_table(field)
+        self.session.execute(
+            f"CREATE VIRTUAL TABLE [{table}] USING fts5([{field}], "
+            f"content='{self.name}', content_rowid='rowid', tokenize=\"{tokenizer}\")"
+        )
+        insert = f"INSERT INTO [{table}] (rowid, [{field}]) VALUES (NEW.rowid, NEW.[{field}]);"
+        delete = (
+            f"INSERT INTO [{table}] ([{table}], rowid, [{field}]) "
+            f"VALUES ('delete', OLD.rowid, OLD.[{field}]);"
+        )
+        self.session.execute(
+            f"CREATE TRIGGER [{table}_insert] AFTER INSERT ON [{self.name}] "
+            f"BEGIN {insert} END"
+        )
+        self.session.execute(
+            f"CREATE TRIGGER [{table}_update] AFTER UPDATE OF [{field}] "
+            f"ON [{self.name}] BEGIN {delete} {insert} END"
+        )
+        self.session.execute(
+            f"CREATE TRIGGER [{table}_delete] AFTER DELETE ON [{self.name}] "
+            f"BEGIN {delete} END"
+        )
+        self.session.execute(f"INSERT INTO [{table}] ([{table}]) VALUES ('rebuild')")
+        self.text_indexes[field] = tokenizer
+        settings = self.settings()
+        settings["text_indexes"] = self.text_indexes
+        self.set_settings(settings)
+        self._clear_sql_cache()
+
+    def remove_text_index(self, field):
+        """
+        Remove the index created by :py:meth:`add_text_index`.
+        """
+        if field not in self.text_indexes:
+            return
+        table = self._text_table(field)
+        for trigger in ("insert", "update", "delete"):
+            self.session.execute(f"DROP TRIGGER IF EXISTS [{table}_{trigger}]")
+        self.session.execute(f"DROP TABLE IF EXISTS [{table}]")
+        del self.text_indexes[field]
+        settings = self.settings()
+        settings["text_indexes"] = self.text_indexes
+        self.set_settings(settings)
+        self._clear_sql_cache()
+
+    def text_index_condition(self, field, query_sql):
+        """
+        Return an SQL condition selecting documents matching a full text
+        query using the table created by :py:meth:`add_text_index`. The
+        text given by ``query_sql`` is quoted to be used as an FTS5 phrase
+        therefore characters such as ``-``, ``.`` or ``/`` are not
+        interpreted as FTS5 query syntax.
+        """
+        table = self._text_table(field)
+        phrase = f"'\"' || replace({query_sql}, '\"', '\"\"') || '\"'"
+        return f"rowid IN (SELECT rowid FROM [{table}] WHERE [{table}] MATCH {phrase})"
+
+    def _catchall_field_type(self, field):
+        """
+        Return the type of a column that can store all the values of a
+        catchall field. The type is guessed from the JSON types of the
+        values. A ValueError is raised if there is no value or if values
+        have incompatible types.
+        """
+        path = f"'$.\"{field}\"'"
+        sql = f"SELECT DISTINCT json_type([{self.catchall_column}], {path}) FROM [{self.name}]"
+        json_types = {row[0] for row in self.session.execute(sql)}
+        json_types.discard(None)
+        json_types.discard("null")
+        if not json_types:
+            raise ValueError(
+                f'No value found for field "{field}" in collection "{self.name}"'
+            )
+        field_type = _json_types_to_type(json_types)
+        if field_type is list:
+            sql = (
+                f"SELECT DISTINCT json_each.type FROM [{self.name}], "
+                f"json_each([{self.name}].[{self.catchall_column}], {path})"
+            )
+            item_type = _json_types_to_type(row[0] for row in self.session.execute(sql))
+            if item_type in (str, int, float, bool):
+                field_type = list[item_type]
+        if field_type is None:
+            raise ValueError(
+                f'Values of field "{field}" in collection "{self.name}" have '
+                f"different types: {', '.join(sorted(json_types))}"
+            )
+        return field_type
+
+    def promote_catchall_field(self, field, field_type=None):
+        """
+        Move a field stored in the catchall column to a new column. Values
+        are moved with UPDATE requests on batches of
+        promotion_batch_size rows. Once promoted, the field is read and
+        written in its column like any other field and filters use the
+        column.
+
+        :param field: Name of a field stored in catchall
+
+        :param field_type: Type of the new column. If not given, it is
+            guessed from existing values.
+        """
+        if field in self.fields:
+            raise ValueError(
+                f'Field "{field}" is already a column of collection "{self.name}"'
+            )
+        if not self.catchall_column:
+            raise ValueError(f'Collection "{self.name}" has no catchall column')
+        if field_type is None:
+            field_type = self._catchall_field_type(field)
+        elif isinstance(field_type, str):
+            field_type = str_to_type(field_type)
+        index = field in self.catchall_indexes
+        if index:
+            sql = f"DROP INDEX IF EXISTS [{self.name}_{self.catchall_column}_{field}]"
+            self.session.execute(sql)
+            self.catchall_indexes.discard(field)
+            settings = self.settings()
+            settings["catchall_indexes"] = sorted(self.catchall_indexes)
+            self.set_settings(settings)
+        path = f"'$.\"{field}\"'"
+        if (getattr(field_type, "__origin__", None) or field_type) in (list, dict):
+            # Values of list and dict columns are stored as JSON text
+            value = f"[{self.catchall_column}] -> {path}"
+        else:
+            value = self.field_sql(field)
+        self.add_field(field, field_type, index=index)
+        sql = (
+            f"UPDATE [{self.name}] SET [{field}]={value}, "
+            f"[{self.catchall_column}]=json_remove([{self.catchall_column}], {path}) "
+            f"WHERE rowid BETWEEN ? AND ? "
+            f"AND json_type([{self.catchall_column}], {path}) IS NOT NULL"
+        )
+        first, last = self.session.execute(
+            f"SELECT min(rowid), max(rowid) FROM [{self.name}]"
+        ).fetchone()
+        if first is not None:
+            for start in range(first, last + 1, self.promotion_batch_size):
+                self.session.execute(
+                    sql, [start, start + self.promotion_batch_size - 1]
+                )
+        self.catchall_usage.pop(field, None)
+
+    def promote_catchall_fields(self, threshold=None):
+        """
+        Call :py:meth:`promote_catchall_field` for all catchall fields
+        that were used at least threshold times in filters or projections
+        (i.e. in fields parameter) since the beginning of the process.
+        Fields without any value or whose values have different types are
+        ignored. Return the list of promoted fields.
+
+        :param threshold: Minimum number of uses. Default is
+            catchall_promotion_threshold.
+        """
+        if threshold is None:
+            threshold = self.catchall_promotion_threshold
+        promoted = []
+        for field, count in list(self.catchall_usage.items()):
+            if field in self.fields:
+                del self.catchall_usage[field]
+                continue
+            if count < threshold:
+                continue
+            try:
+                field_type = self._catchall_field_type(field)
+            except ValueError:
+                continue
+            self.promote_catchall_field(field, field_type)
+            promoted.append(field)
+        return promoted
+
+    def _clear_sql_cache(self):
+        """
+        Forget all cached SQL requests and compiled filters. Must be called
+        whenever the columns of the table are modified.
+        """
+        self._sql_cache = {}
+        parsed_filter_cache.invalidate(self.name)
+
+    def _primary_key_where(self):
+        sql = self._sql_cache.get("primary_key_where")
+        if sql is None:
+            sql = " AND ".join(f"[{i}] = ?" for i in self.primary_key)
+            self._sql_cache["primary_key_where"] = sql
+        return sql
 
     def has_document(self, document_id):
         document_id = self.document_id(document_id)
-        sql = f"SELECT count(*) FROM [{self.name}] WHERE {' AND '.join(f'[{i}] = ?' for i in self.primary_key)}"
+        sql = self._sql_cache.get("has_document")
+        if sql is None:
+            sql = (
+                f"SELECT count(*) FROM [{self.name}] WHERE {self._primary_key_where()}"
+            )
+            self._sql_cache["has_document"] = sql
         return next(self.session.execute(sql, document_id))[0] != 0
 
-    def _documents(self, where, where_data, fields, as_list, distinct):
-        json_decode_columns = []
+    def _select(self, fields, as_list, distinct, lazy=False):
+        """
+        Return the SELECT request (without WHERE clause) and a decoding
+        plan for its result rows. The plan is a tuple containing the list
+        of selected fields, a list of (column index, decode function) for
+        the columns whose values must be decoded, and a function converting
+        a result row to a document (or to a list if as_list is True). If
+        lazy is True, documents with catchall fields are LazyDocument
+        instances. The result is cached until the table columns are
+        modified.
+        """
+        if fields and self.catchall_column:
+            self.catchall_usage.update(i for i in fields if i not in self.fields)
+        key = ("select", tuple(fields) if fields else None, as_list, distinct, lazy)
+        select = self._sql_cache.get(key)
+        if select is not None:
+            return select
+        json_decode_columns = set()
         if fields:
+            fields = list(fields)
             columns = []
             catchall_fields = False
             for field in fields:
                 if field in self.fields:
                     columns.append(f"[{field}]")
                 else:
-                    json_decode_columns.append(len(columns))
+                    json_decode_columns.add(len(columns))
                     columns.append(f"[{self.catchall_column}] -> '$.{field}'")
         else:
-            fields = self.fields
+            fields = list(self.fields)
             columns = [f"[{i}]" for i in fields]
             catchall_fields = bool(self.catchall_column)
             if catchall_fields:
@@ -355,69 +1547,329 @@ class SQLiteCollection(DatabaseCollection):
                         f"as_list=True cannot be used on {self.name} without a fields list because two documents can have different fields"
                     )
 
+        decoders = []
+        for index, field in enumerate(fields):
+            if index in json_decode_columns:
+                decoders.append((index, _json_loads))
+                continue
+            encoding = self.fields[field].get("encoding")
+            decode = encoding[1] if encoding else None
+            if field in self.bad_json_fields:
+                if encoding in (
+                    self._column_encodings[list],
+                    self._column_encodings[dict],
+                ):
+                    decode = _json_loads_decode
+                elif decode:
+                    decode = _compose(json_decode, decode)
+                else:
+                    decode = json_decode
+            if decode:
+                decoders.append((index, decode))
+        row_to_document = _row_decoder(fields, decoders, as_list, catchall_fields, lazy)
+
         sql = f"SELECT {('DISTINCT ' if distinct else '')}{','.join(columns)} FROM [{self.name}]"
+        select = (sql, fields, decoders, row_to_document)
+        self._sql_cache[key] = select
+        return select
+
+    def _documents(
+        self,
+        where,
+        where_data,
+        fields,
+        as_list,
+        distinct,
+        batch_size=None,
+        lazy=False,
+        order=None,
+    ):
+        """
+        Iterates over the documents selected by a WHERE clause. If
+        batch_size is given, lists of at most batch_size documents are
+        yielded instead of individual documents and rows are read from
+        the database with fetchmany(). order is an optional ORDER BY
+        and/or LIMIT clause added at the end of the request.
+        """
+        sql, fields, _, row_to_document = self._select(fields, as_list, distinct, lazy)
         if where:
-            sql += f" WHERE {where}"
+            sql = f"{sql} WHERE {where}"
+        if order:
+            sql = f"{sql} {order}"
         cur = self.session.execute(sql, where_data)
-        for row in cur:
-            for i in json_decode_columns:
-                if row[i] is None:
-                    continue
-                if isinstance(row, tuple):
-                    row = list(row)
-                row[i] = json.loads(row[i])
-            if catchall_fields:
-                if row[-1] is not None:
-                    catchall = json.loads(row[-1])
-                    if isinstance(catchall_fields, set):
-                        catchall = {i: catchall[i] for i in catchall_fields}
-                else:
-                    catchall = {}
-                row = row[:-1]
-            else:
-                catchall = {}
-            if columns[-1] == self.catchall_column:
-                columns = columns[:-1]
-            document = json_decode(catchall)
-            if isinstance(document, dict):
-                document.update(zip(fields, row, strict=True))
-                for field, value in document.items():
-                    encoding = self.fields.get(field, {}).get("encoding")
-                    if encoding:
-                        encode, decode = encoding
-                        value = decode(value)
-                    if field in self.bad_json_fields:
-                        value = json_decode(value)
-                    document[field] = value
-                if as_list:
-                    yield [document[i] for i in fields]
-                else:
-                    yield document
-            else:
-                yield document
+        if batch_size:
+            while True:
+                rows = cur.fetchmany(batch_size)
+                if not rows:
+                    break
+                yield [row_to_document(row) for row in rows]
+        else:
+            yield from map(row_to_document, cur)
+
+    def _columns(self, where, where_data, fields, distinct, order=None):
+        """
+        Return the selected documents as a dict whose keys are field names
+        and values are NumPy arrays. Arrays of int, float, bool, date and
+        datetime fields have a NumPy dtype unless they contain a NULL value
+        that cannot be represented in this dtype (NaN and NaT are used for
+        float, date and datetime). Other fields are stored in object arrays.
+        """
+        # Import numpy in this function to avoid making it a mandatory
+        # dependency
+        import numpy
+
+        # Use as_list=True to raise an error if fields are not given for
+        # a collection with a catchall column.
+        sql, fields, decoders, _ = self._select(fields, True, distinct)
+        if where:
+            sql = f"{sql} WHERE {where}"
+        if order:
+            sql = f"{sql} {order}"
+        rows = self.session.execute(sql, where_data).fetchall()
+        count = len(rows)
+        decoders = dict(decoders)
+        result = {}
+        for index, field in enumerate(fields):
+            dtype = _numpy_dtypes.get(self.fields.get(field, {}).get("type"))
+            values = (row[index] for row in rows)
+            decode = decoders.get(index)
+            if decode:
+                values = map(decode, values)
+            elif dtype in ("int64", "bool") and any(row[index] is None for row in rows):
+                dtype = None
+            result[field] = numpy.fromiter(values, dtype=dtype or object, count=count)
+        return result
 
     def count(self, filter=None):
         where = self.parse_filter(filter)
         sql = f"SELECT COUNT(*) FROM [{self.name}]"
         if where:
             sql += f" WHERE {where}"
-        return self.session.execute(sql, None).fetchone()[0]
+            return self.session.execute(sql, where.parameters).fetchone()[0]
+        return self.session.execute(sql).fetchone()[0]
+
+    _aggregate_functions: ClassVar[dict[str, str]] = {
+        "count": "COUNT",
+        "sum": "SUM",
+        "min": "MIN",
+        "max": "MAX",
+        "avg": "AVG",
+    }
 
-    def document(self, document_id, fields=None, as_list=False):
+    # Functions converting values returned by an aggregate request
+    # to Python values for column types that use SQLite converters.
+    _aggregate_decodings: ClassVar[dict] = {
+        bool: bool,
+        datetime: parse_datetime,
+        date: parse_date,
+        time: parse_time,
+    }
+
+    def _field_sql_encoding(self, field):
+        """
+        Return the (encode, decode) functions converting a Python value to
+        a value comparable with the field_sql() expression of a field and
+        back, or None if no conversion is needed.
+        """
+        field_info = self.fields.get(field)
+        if field_info is None:
+            return None
+        encoding = field_info.get("encoding")
+        if encoding and field_info.get("packed"):
+            # field_sql() returns packed lists as JSON text. Values are
+            # packed and unpacked to get the same item types.
+            encode, decode = encoding
+
+            def encode_json(value):
+                return None if value is None else json_dumps(decode(encode(value)))
+
+            return (encode_json, _json_loads)
+        return encoding
+
+    def _aggregate_decoder(self, field, group=False):
+        """
+        Return a function converting a column value that is returned by
+        an aggregate request or None if no conversion is needed. Values of
+        group columns are selected as is and are therefore already
+        converted by SQLite according to the column type. Values computed
+        by an aggregate function are not.
+        """
+        field_info = self.fields.get(field)
+        if field_info is None:
+            return None
+        encoding = self._field_sql_encoding(field)
+        if encoding:
+            return encoding[1]
+        if group:
+            return None
+        decode = self._aggregate_decodings.get(field_info["type"])
+        if decode:
+            return lambda value: None if value is None else decode(value)
+        return None
+
+    def aggregate(self, filter=None, group_by=None, metrics=None):
+        columns = []
+        decoders = []
+        names = []
+        if isinstance(group_by, str):
+            group_by = [group_by]
+        group_by = list(group_by or ())
+        for field in group_by:
+            columns.append(self.field_sql(field))
+            decoders.append(self._aggregate_decoder(field, group=True))
+            names.append(field)
+        if metrics is None:
+            metrics = {"count": "count"}
+        for name, metric in metrics.items():
+            if isinstance(metric, str):
+                function, field = metric, None
+            else:
+                function, field = metric
+            sql_function = self._aggregate_functions.get(function)
+            if sql_function is None:
+                raise ValueError(f'Invalid aggregate function "{function}"')
+            if field is None:
+                if function != "count":
+                    raise ValueError(f'Aggregate function "{function}" needs a field')
+                columns.append("COUNT(*)")
+                decoders.append(None)
+            else:
+                columns.append(f"{sql_function}({self.field_sql(field)})")
+                if function in ("min", "max"):
+                    decoders.append(self._aggregate_decoder(field))
+                else:
+                    decoders.append(None)
+            names.append(name)
+        if not columns:
+            raise ValueError("aggregate() requires group_by fields or metrics")
+
+        where = self.parse_filter(filter)
+        sql = f"SELECT {','.join(columns)} FROM [{self.name}]"
+        if where:
+            sql += f" WHERE {where}"
+        if group_by:
+            group_columns = ",".join(columns[: len(group_by)])
+            sql += f" GROUP BY {group_columns} ORDER BY {group_columns}"
+        decoders = [(i, d) for i, d in enumerate(decoders) if d is not None]
+        result = []
+        for row in self.session.execute(sql, where.parameters if where else None):
+            if decoders:
+                row = list(row)
+                for index, decode in decoders:
+                    row[index] = decode(row[index])
+            result.append(dict(zip(names, row, strict=True)))
+        return result
+
+    def document(self, document_id, fields=None, as_list=False, lazy=False):
         document_id = self.document_id(document_id)
-        where = f"{' AND '.join(f'[{i}] = ?' for i in self.primary_key)}"
+        where = self._primary_key_where()
         try:
-            return next(self._documents(where, document_id, fields, as_list, False))
+            return next(
+                self._documents(where, document_id, fields, as_list, False, lazy=lazy)
+            )
         except StopIteration:
             return None
 
-    def documents(self, fields=None, as_list=False, distinct=False):
-        yield from self._documents(None, None, fields, as_list, distinct)
+    def documents(
+        self, fields=None, as_list=False, distinct=False, as_columns=False, lazy=False
+    ):
+        if as_columns:
+            return self._columns(None, None, fields, distinct)
+        return self._documents(None, None, fields, as_list, distinct, lazy=lazy)
+
+    def documents_by_ids(self, ids, fields=None, as_list=False):
+        """
+        Iterates over the documents whose primary key is in a list of
+        identifiers. A single SQL request is done: the collection is joined
+        with the list of keys and their position. Up to
+        documents_by_ids_in_limit keys are given in a VALUES list, above
+        this limit they are given as a JSON array read with json_each().
+        Documents are returned in the order of ids (a document is returned
+        several times if its identifier is repeated) and non existing
+        documents are ignored.
+
+        :param ids: iterable of document identifiers. For collections with
+            several primary key fields, each identifier is a list or tuple
+            of values.
+
+        :param fields: list of fields to retrieve in the documents
+
+        :param as_list: If True, document values are returned in a list
+            using fields order
+        """
+        ids = [self.document_id(i) for i in ids]
+        if not ids:
+            return
+        # Keys are compared to primary key columns in SQL in order to use
+        # the same type conversions (column affinity) as document().
+        key_count = len(self.primary_key)
+        if len(ids) <= self.documents_by_ids_in_limit:
+            values = ",".join(
+                f"column{i + 2} AS populse_db_key{i}" for i in range(key_count)
+            )
+            row = f"({','.join('?' for i in range(key_count + 1))})"
+            ids_sql = (
+                f"SELECT column1 AS populse_db_order,{values} "
+                f"FROM (VALUES {','.join(row for i in ids)})"
+            )
+            data = [v for index, i in enumerate(ids) for v in (index, *i)]
+        else:
+            if key_count == 1:
+                values = "value AS populse_db_key0"
+                json_ids = [i[0] for i in ids]
+            else:
+                values = ",".join(
+                    f"value->>{i} AS populse_db_key{i}" for i in range(key_count)
+                )
+                json_ids = ids
+            ids_sql = f"SELECT key AS populse_db_order,{values} FROM json_each(?)"
+            # Date and time keys are written with isoformat() by sqlite3
+            # adapters
+            data = [json_dumps(json_ids, default=lambda v: v.isoformat())]
+        on = " AND ".join(
+            f"[{self.name}].[{field}]=populse_db_ids.populse_db_key{i}"
+            for i, field in enumerate(self.primary_key)
+        )
+        sql, _, _, row_to_document = self._select(fields, as_list, False)
+        sql = (
+            f"{sql} JOIN ({ids_sql}) AS populse_db_ids ON {on} "
+            "ORDER BY populse_db_ids.populse_db_order"
+        )
+        yield from map(row_to_document, self.session.execute(sql, data))
 
     def add(self, document, replace=False):
         document_id = tuple(document.get(i) for i in self.primary_key)
         self._set_document(document_id, document, replace=replace)
 
+    def add_many(self, documents, replace=False):
+        """
+        Adds several documents using as few SQL requests as possible.
+
+        Consecutive documents stored in the same set of columns are
+        inserted with a single ``executemany()`` call that reuses the same
+        prepared statement. Documents are inserted in the given order,
+        therefore the result is the same as calling :py:meth:`add` on each
+        document.
+
+        :param documents: iterable of documents (dict)
+
+        :param replace: if True, existing documents with the same primary
+            key are replaced. Otherwise an exception is raised.
+        """
+        columns = None
+        rows = []
+        for document in documents:
+            document_id = tuple(document.get(i) for i in self.primary_key)
+            document_columns, data = self._sql_insert_data(document_id, document)
+            if document_columns != columns or len(rows) >= self.add_many_batch_size:
+                if rows:
+                    self._insert_many(columns, rows, replace)
+                columns = document_columns
+                rows = []
+            rows.append(data)
+        if rows:
+            self._insert_many(columns, rows, replace)
+
     def __setitem__(self, document_id, document):
         document_id = self.document_id(document_id)
         self._set_document(document_id, document, replace=True)
@@ -427,6 +1879,7 @@ class SQLiteCollection(DatabaseCollection):
         data = []
         catchall_column = None
         catchall_data = None
+        catchall_json = None
         catchall = ...
         if isinstance(document, dict):
             catchall = {}
@@ -451,7 +1904,8 @@ class SQLiteCollection(DatabaseCollection):
             bad_json = False
             try:
                 catchall_data = catchall
-                json_dumps(catchall)
+                # The text is kept to be stored without encoding it again
+                catchall_json = json_dumps(catchall)
             except TypeError:
                 if isinstance(catchall, dict):
                     bad_json = True
@@ -467,7 +1921,12 @@ class SQLiteCollection(DatabaseCollection):
                     except TypeError:
                         bad_json = True
                     if bad_json:
-                        self.add_field(field, dict, bad_json=True)
+                        # NumPy arrays get a ndarray field instead of a JSON one
+                        numpy = sys.modules.get("numpy")
+                        if numpy is not None and isinstance(value, numpy.ndarray):
+                            self.add_field(field, numpy.ndarray)
+                        else:
+                            self.add_field(field, dict, bad_json=True)
                         column_value = self._encode_column_value(field, value)
                         columns.append(field)
                         data.append(column_value)
@@ -476,27 +1935,47 @@ class SQLiteCollection(DatabaseCollection):
                 if jsons:
                     catchall_column = self.catchall_column
                     catchall_data = jsons
+                    catchall_json = json_dumps(jsons)
 
             else:
                 catchall_column = self.catchall_column
-        return columns, data, catchall_column, catchall_data
+        return columns, data, catchall_column, catchall_data, catchall_json
 
-    def _set_document(self, document_id, document, replace):
-        columns, data, catchall_column, catchall_data = self._dict_to_sql_update(
-            document
-        )
-        catchall_data = json.dumps(json_encode(catchall_data))
+    def _sql_insert_data(self, document_id, document):
+        (
+            columns,
+            data,
+            catchall_column,
+            catchall_data,
+            catchall_json,
+        ) = self._dict_to_sql_update(document)
         columns = [i for i in self.primary_key] + columns
         data = [i for i in document_id] + data
         if catchall_column:
             columns.append(catchall_column)
-            data.append(catchall_data)
-        if replace:
-            replace = " OR REPLACE"
-        else:
-            replace = ""
-        sql = f"INSERT{replace} INTO [{self.name}] ({','.join(f'[{i}]' for i in columns)}) values ({','.join('?' for i in data)})"
-        self.session.execute(sql, data)
+            if catchall_json is None:
+                catchall_json = json_encode_dumps(catchall_data)
+            data.append(catchall_json)
+        return tuple(columns), data
+
+    def _insert_sql(self, columns, replace):
+        key = ("insert", columns, bool(replace))
+        sql = self._sql_cache.get(key)
+        if sql is None:
+            if replace:
+                replace = " OR REPLACE"
+            else:
+                replace = ""
+            sql = f"INSERT{replace} INTO [{self.name}] ({','.join(f'[{i}]' for i in columns)}) values ({','.join('?' for i in columns)})"
+            self._sql_cache[key] = sql
+        return sql
+
+    def _set_document(self, document_id, document, replace):
+        columns, data = self._sql_insert_data(document_id, document)
+        self.session.execute(self._insert_sql(columns, replace), data)
+
+    def _insert_many(self, columns, rows, replace):
+        self.session.executemany(self._insert_sql(columns, replace), rows)
 
     def update_document(self, document_id, partial_document):
         document_id = self.document_id(document_id)
@@ -509,7 +1988,43 @@ class SQLiteCollection(DatabaseCollection):
             )
         ):
             raise ValueError("Modification of a document's primary key is not allowed")
-        columns, data, catchall_column, catchall_data = self._dict_to_sql_update(
+        affectations, data = self._sql_update_affectations(partial_document)
+        if not affectations:
+            return
+        data = data + [i for i in document_id]
+        sql = f"UPDATE [{self.name}] SET {','.join(affectations)} WHERE {self._primary_key_where()}"
+        cur = self.session.execute(sql, data)
+        if not cur.rowcount:
+            raise ValueError(f"Document with key {document_id} does not exist")
+
+    def update_documents(self, filter, partial_document):
+        """
+        Modifies all the documents selected by a filter with a single
+        UPDATE request. Values of fields that are not columns are set in
+        the catchall column with json_set().
+
+        :param filter: filter selecting the documents to modify (see
+            :py:meth:`filter`)
+
+        :param partial_document: dict containing the values to set
+
+        :return: the number of modified documents
+        """
+        if any(i in partial_document for i in self.primary_key):
+            raise ValueError("Modification of a document's primary key is not allowed")
+        affectations, data = self._sql_update_affectations(partial_document)
+        if not affectations:
+            return 0
+        where = self.parse_filter(filter)
+        sql = f"UPDATE [{self.name}] SET {','.join(affectations)}"
+        if where:
+            sql += f" WHERE {where}"
+            data += where.parameters
+        cur = self.session.execute(sql, data)
+        return cur.rowcount
+
+    def _sql_update_affectations(self, partial_document):
+        columns, data, catchall_column, catchall_data, _ = self._dict_to_sql_update(
             partial_document
         )
 
@@ -518,39 +2033,254 @@ class SQLiteCollection(DatabaseCollection):
                 f'[{catchall_column}]=json_set(IFNULL([{catchall_column}],"{{}}"),{",".join("?,json(?)" for i in catchall_data)})'
             ]
             for k, v in catchall_data.items():
-                data.append(f"$.{k}")
+                data.append(_json_key_path(k))
                 data.append(json.dumps(v))
         else:
             catchall_update = []
-        where = " AND ".join(f"[{i}]=?" for i in self.primary_key)
-        data = data + [i for i in document_id]
         affectations = [f"[{i}]=?" for i in columns] + catchall_update
-        if not affectations:
-            return
-        sql = f"UPDATE [{self.name}] SET {','.join(affectations)} WHERE {where}"
-        cur = self.session.execute(sql, data)
-        if not cur.rowcount:
-            raise ValueError(f"Document with key {document_id} does not exist")
+        return affectations, data
 
     def __delitem__(self, document_id):
         document_id = self.document_id(document_id)
-        sql = f"DELETE FROM [{self.name}] WHERE {' AND '.join(f'[{i}] = ?' for i in self.primary_key)}"
+        sql = self._sql_cache.get("delete")
+        if sql is None:
+            sql = f"DELETE FROM [{self.name}] WHERE {self._primary_key_where()}"
+            self._sql_cache["delete"] = sql
         self.session.execute(sql, document_id)
 
+    def _filter_cache_key(self, filter):
+        schema = self._sql_cache.get("filter_schema")
+        if schema is None:
+            schema = (
+                self.catchall_column,
+                frozenset(self.fields),
+                frozenset(self.element_indexes),
+                frozenset(self.text_indexes.items()),
+                # field_sql() of packed fields depends on their type
+                frozenset(
+                    (field, type_to_str(info["type"]))
+                    for field, info in self.fields.items()
+                    if info.get("packed")
+                ),
+            )
+            self._sql_cache["filter_schema"] = schema
+        return (self.name, schema, filter)
+
     def parse_filter(self, filter):
         if filter is None or isinstance(filter, ParsedFilter):
             return filter
+        key = self._filter_cache_key(filter)
+        result = parsed_filter_cache.get(key, self)
+        if result is not self:
+            if result is not None:
+                if result.catchall_fields:
+                    self.catchall_usage.update(result.catchall_fields)
+                if self.session.workload is not None:
+                    self.session.workload.add_filter(self.name, result)
+            return result
         tree = filter_parser().parse(filter)
-        where_filter = FilterToSQL(self).transform(tree)
+        filter_to_sql = FilterToSQL(self)
+        where_filter = filter_to_sql.transform(tree)
         if where_filter is None:
-            return None
+            result = None
         else:
-            return ParsedFilter(" ".join(where_filter))
+            result = ParsedFilter(" ".join(where_filter))
+            result.parameters = tuple(filter_to_sql.parameters)
+            result.catchall_fields = tuple(filter_to_sql.catchall_fields)
+            result.index_conditions = tuple(filter_to_sql.index_conditions)
+            self.catchall_usage.update(result.catchall_fields)
+            if self.session.workload is not None:
+                self.session.workload.add_filter(self.name, result)
+        parsed_filter_cache.set(key, result)
+        return result
+
+    def field_sql(self, field):
+        """
+        Return the SQL expression giving the value of a field: the column
+        name for column fields or a json_extract() on the catchall column
+        for other fields. The same expression is used in filters and in
+        ORDER BY clauses.
+        """
+        field_info = self.fields.get(field)
+        if field_info is not None:
+            if field_info.get("packed"):
+                # Packed lists are converted to JSON to have the same
+                # behavior as other list fields
+                typecode = _packed_typecodes[field_info["type"].__args__[0]]
+                return f"populse_db_unpack([{field}],'{typecode}')"
+            return f"[{field}]"
+        elif self.catchall_column:
+            return f"json_extract([{self.catchall_column}],'$.\"{field}\"')"
+        raise ValueError(
+            f'Unknown field "{field}" in collection "{self.name}" that does not support it'
+        )
+
+    def _paginate(self, where, where_data, order_by, limit, after, distinct):
+        """
+        Return (where, where_data, order) where where and where_data are
+        the WHERE clause and its parameters combined with the keyset
+        cursor condition (if after is given) and order contains the
+        ORDER BY and LIMIT clauses.
+
+        Documents are sorted on order_by fields followed by primary key
+        fields (unless distinct is True) to make the order total. The
+        cursor condition uses a row value comparison when it is equivalent
+        to the sort order (ascending order without NULL in the cursor or
+        descending order on primary key only) in order to allow SQLite to
+        use an index on sort fields. Otherwise it is expanded in a
+        disjunction that takes NULL values into account (NULL values are
+        sorted first in ascending order and last in descending order).
+        """
+        if isinstance(order_by, str):
+            order_by = [order_by]
+        keys = []
+        for field in order_by or ():
+            if field.startswith("-"):
+                keys.append((field[1:], True))
+            else:
+                keys.append((field, False))
+        if not distinct:
+            descending = keys[-1][1] if keys else False
+            sort_fields = {field for field, descending in keys}
+            keys.extend(
+                (field, descending)
+                for field in self.primary_key
+                if field not in sort_fields
+            )
+        columns = [self.field_sql(field) for field, descending in keys]
+        data = list(where_data or ())
+        if after is not None:
+            if distinct:
+                raise ValueError("after cannot be used with distinct=True")
+            if isinstance(after, Mapping):
+                # A document without a catchall key has a NULL value for
+                # this key but column fields (including primary key) are
+                # always in whole documents. If they are missing, the
+                # cursor is not a document of the sorted result (e.g. it
+                # was selected with a fields list).
+                missing = [
+                    field
+                    for field, descending in keys
+                    if field in self.fields and field not in after
+                ]
+                if missing:
+                    raise ValueError(
+                        f"after does not contain sort fields: {', '.join(missing)}"
+                    )
+                values = [after.get(field) for field, descending in keys]
+            else:
+                values = list(after)
+                if len(values) != len(keys):
+                    raise ValueError(
+                        f"after must contain {len(keys)} values: "
+                        f"{', '.join(field for field, descending in keys)}"
+                    )
+            for i, key in enumerate(keys):
+                encoding = self._field_sql_encoding(key[0])
+                if encoding:
+                    values[i] = encoding[0](values[i])
+            directions = {descending for field, descending in keys}
+            if directions == {False} and None not in values:
+                condition = f"({','.join(columns)}) > ({','.join('?' * len(values))})"
+                data.extend(values)
+            elif directions == {True} and all(
+                field in self.primary_key for field, descending in keys
+            ):
+                condition = f"({','.join(columns)}) < ({','.join('?' * len(values))})"
+                data.extend(values)
+            else:
+                terms = []
+                for i, (column, value, key) in enumerate(
+                    zip(columns, values, keys, strict=True)
+                ):
+                    descending = key[1]
+                    term = [f"{c} IS ?" for c in columns[:i]]
+                    term_data = values[:i]
+                    if value is None:
+                        if descending:
+                            # Nothing is sorted after NULL in descending order
+                            continue
+                        term.append(f"{column} IS NOT NULL")
+                    elif descending and key[0] in self.primary_key:
+                        term.append(f"{column} < ?")
+                        term_data.append(value)
+                    elif descending:
+                        term.append(f"({column} < ? OR {column} IS NULL)")
+                        term_data.append(value)
+                    else:
+                        term.append(f"{column} > ?")
+                        term_data.append(value)
+                    terms.append(f"({' AND '.join(term)})")
+                    data.extend(term_data)
+                condition = " OR ".join(terms) or "0"
+            where = f"({where}) AND ({condition})" if where else condition
+        order = ""
+        if keys:
+            order = "ORDER BY " + ",".join(
+                f"{column} DESC" if descending else column
+                for column, (field, descending) in zip(columns, keys, strict=True)
+            )
+        if limit is not None:
+            order = f"{order} LIMIT ?"
+            data.append(int(limit))
+        return where, data, order
 
-    def filter(self, filter, fields=None, as_list=False, distinct=False):
+    def filter(
+        self,
+        filter,
+        fields=None,
+        as_list=False,
+        distinct=False,
+        as_columns=False,
+        lazy=False,
+        order_by=None,
+        limit=None,
+        after=None,
+    ):
+        parsed_filter = self.parse_filter(filter)
+        where = parsed_filter
+        where_data = parsed_filter.parameters if parsed_filter else None
+        order = None
+        if order_by or limit is not None or after is not None:
+            where, where_data, order = self._paginate(
+                where, where_data, order_by, limit, after, distinct
+            )
+        if as_columns:
+            return self._columns(where, where_data, fields, distinct, order=order)
+        return self._documents(
+            where,
+            where_data,
+            fields=fields,
+            as_list=as_list,
+            distinct=distinct,
+            lazy=lazy,
+            order=order,
+        )
+
+    def filter_batches(
+        self,
+        filter,
+        fields=None,
+        as_list=False,
+        distinct=False,
+        batch_size=1000,
+        lazy=False,
+    ):
+        """
+        Like :py:meth:`filter` but yields lists of at most batch_size
+        documents. Rows are read from the database with fetchmany(), so
+        the memory used does not depend on the number of selected
+        documents.
+        """
         parsed_filter = self.parse_filter(filter)
         yield from self._documents(
-            parsed_filter, None, fields=fields, as_list=as_list, distinct=distinct
+            parsed_filter,
+            parsed_filter.parameters if parsed_filter else None,
+            fields=fields,
+            as_list=as_list,
+            distinct=distinct,
+            batch_size=batch_size,
+            lazy=lazy,
         )
 
     def delete(self, filter):
@@ -558,5 +2288,7 @@ class SQLiteCollection(DatabaseCollection):
         sql = f"DELETE FROM [{self.name}]"
         if where:
             sql += f" WHERE {where}"
-        cur = self.session.execute(sql)
+            cur = self.session.execute(sql, where.parameters)
+        else:
+            cur = self.session.execute(sql)
         return cur.rowcount
@@ -1,5 +1,6 @@
 import ast
 import datetime
+from typing import ClassVar
 
 import dateutil.parser
 from lark import Lark, Transformer
@@ -31,6 +32,7 @@ CONDITION_OPERATOR : "=="i
                    | "IN"i
                    | "ILIKE"i
                    | "LIKE"i
+                   | "MATCH"i
 
 condition : "ALL"i                         -> all
           | operand CONDITION_OPERATOR operand
@@ -109,9 +111,13 @@ def literal_parser():
     return Lark(filter_grammar, parser="lalr", start="literal")
 
 
-def _list_to_sql(value):
+def _list_to_json(value):
     s = ",".join(f'"{x}"' if isinstance(x, str) else to_sql(x) for x in value)
-    return f"'[{s}]'"
+    return f"[{s}]"
+
+
+def _list_to_sql(value):
+    return f"'{_list_to_json(value)}'"
 
 
 _type_to_sql = {
@@ -134,7 +140,8 @@ def to_sql(value):
 
 
 class Field(str):
-    pass
+    # Name of the field whose SQL expression is the string value
+    name = None
 
 
 class FilterToSQL(Transformer):
@@ -168,17 +175,60 @@ class FilterToSQL(Transformer):
         "ilike": "LIKE",
     }
 
-    no_list_operators = {">", "<", ">=", "<=", "like", "ilike"}
+    no_list_operators = {">", "<", ">=", "<=", "like", "ilike", "match"}
 
     def __init__(self, dbcollection):
         self.dbcollection = dbcollection
+        self.parameters = []
+        # Fields used in the filter that are not columns
+        self.catchall_fields = set()
+        # List of (field name, kind) for conditions comparing a field with
+        # literal values where kind is "eq" for equality tests (that can
+        # use any index column) or "range" for other comparisons (that can
+        # only use the last index column)
+        self.index_conditions = []
+
+    def parameter(self, value):
+        """
+        Record a literal value as a parameter of the SQL request and return
+        the corresponding placeholder. Parameters must be created in the
+        order of their placeholders in the resulting SQL.
+
+        :param value: Python literal
+        """
+        if isinstance(value, list):
+            value = _list_to_json(value)
+        self.parameters.append(value)
+        return "?"
 
     def all(self, items):
         return self.build_condition_all()
 
+    index_operators: ClassVar[dict[str, str]] = {
+        "==": "eq",
+        "in": "eq",
+        "<": "range",
+        ">": "range",
+        "<=": "range",
+        ">=": "range",
+        "like": "range",
+    }
+
     def condition(self, items):
         left_operand, operator, right_operand = items
         operator_str = str(operator).lower()
+        kind = self.index_operators.get(operator_str)
+        if kind:
+            if isinstance(left_operand, Field) and not isinstance(right_operand, Field):
+                if left_operand.name:
+                    self.index_conditions.append((left_operand.name, kind))
+            elif (
+                isinstance(right_operand, Field)
+                and not isinstance(left_operand, Field)
+                and operator_str != "in"
+                and right_operand.name
+            ):
+                self.index_conditions.append((right_operand.name, kind))
         if operator_str == "in":
             if isinstance(right_operand, Field):
                 if left_operand is None or isinstance(
@@ -304,15 +354,16 @@ class FilterToSQL(Transformer):
         if literal is not self:
             return literal
         if field in self.dbcollection.fields:
-            return Field(f"[{field}]")
+            result = Field(self.dbcollection.field_sql(field))
         elif self.dbcollection.catchall_column:
-            return Field(
-                f"json_extract([{self.dbcollection.catchall_column}],'$.\"{field}\"')"
-            )
+            self.catchall_fields.add(field)
+            result = Field(self.dbcollection.field_sql(field))
         else:
             raise ValueError(
                 f'Filter uses unknown field "{field}" in collection "{self.dbcollection.name}" that does not support it'
             )
+        result.name = field
+        return result
 
     def quoted_field_name(self, items):
         return Field(items[0][1:-1])
@@ -334,9 +385,15 @@ class FilterToSQL(Transformer):
         :param list_field: field object as returned by Database.get_field
 
         """
+        if list_field.name in getattr(self.dbcollection, "element_indexes", ()):
+            return [
+                self.dbcollection.element_index_condition(
+                    list_field.name, self.parameter(value)
+                )
+            ]
         return [
             f"{list_field} IS NOT NULL AND "
-            f"{to_sql(value)} IN (SELECT value FROM json_each({list_field}))"
+            f"{self.parameter(value)} IN (SELECT value FROM json_each({list_field}))"
         ]
 
     def build_condition_field_in_list_field(self, field, list_field):
@@ -368,9 +425,9 @@ class FilterToSQL(Transformer):
         if not list_value:
             return ["0"]
         elif len(list_value) == 1:
-            where.append(f"IS {to_sql(list_value[0])}")
+            where.append(f"IS {self.parameter(list_value[0])}")
         else:
-            where.append(f"IN ({','.join(to_sql(i) for i in list_value)})")
+            where.append(f"IN ({','.join(self.parameter(i) for i in list_value)})")
         return where
 
     def build_condition_field_op_field(self, left_field, operator_str, right_field):
@@ -382,6 +439,8 @@ class FilterToSQL(Transformer):
                          defined in the grammar (in lowercase)
         :param right_field: field object as returned by Database.get_field
         """
+        if operator_str == "match":
+            raise ValueError("Right operand of MATCH must be a literal string")
         sql_operator = self.sql_operators.get(operator_str, operator_str)
         if operator_str == "ilike":
             return [f"UPPER({left_field}) {sql_operator} UPPER({right_field})"]
@@ -403,6 +462,8 @@ class FilterToSQL(Transformer):
                 raise ValueError(
                     f"operator {operator_str} cannot be used with value of list type"
                 )
+        if operator_str == "match":
+            return [self.build_condition_match(field, value)]
         if operator_str == "ilike":
             field = f"UPPER({field})"
             if isinstance(value, str):
@@ -410,7 +471,21 @@ class FilterToSQL(Transformer):
         else:
             field = f"{field}"
         sql_operator = self.sql_operators.get(operator_str, operator_str)
-        return [f"{field} {sql_operator} {to_sql(value)}"]
+        return [f"{field} {sql_operator} {self.parameter(value)}"]
+
+    def build_condition_match(self, field, value):
+        """
+        Builds a full text search condition using the text index of a
+        field (see SQLiteCollection.add_text_index).
+
+        :param field: field object as returned by Database.get_field
+        :param value: full text query (str)
+        """
+        if field.name not in getattr(self.dbcollection, "text_indexes", {}):
+            raise ValueError(
+                f'MATCH operator requires a text index on field "{field.name}"'
+            )
+        return self.dbcollection.text_index_condition(field.name, self.parameter(value))
 
     def build_condition_value_op_field(self, value, operator_str, field):
         """
@@ -427,12 +502,14 @@ class FilterToSQL(Transformer):
                 raise ValueError(
                     f"operator {operator_str} cannot be used with value of list type"
                 )
+        if operator_str == "match":
+            raise ValueError("Left operand of MATCH must be a field")
         if operator_str == "ilike":
             field = f"UPPER({field})"
             if isinstance(value, str):
                 value = value.upper()
         sql_operator = self.sql_operators.get(operator_str, operator_str)
-        return [f"{to_sql(value)} {sql_operator} {field}"]
+        return [f"{self.parameter(value)} {sql_operator} {field}"]
 
     def build_condition_negation(self, condition):
         """
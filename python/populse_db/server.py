@@ -9,9 +9,9 @@ from typing import Annotated
 
 import uvicorn
 from fastapi import Body, FastAPI, Query, Request
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, Response
 
-from .database import json_decode, json_encode, populse_db_table
+from .database import json_decode, json_encode_dumps, populse_db_table
 from .storage_api import StorageFileAPI, generate_secret, serialize_exception
 
 body_str = Annotated[str, Body(embed=True)]
@@ -33,6 +33,15 @@ def str_to_json(value):
     return value
 
 
+def json_response(value):
+    """
+    Return a response containing value serialized with tagged values in a
+    single pass. This avoids the traversal of the result by json_encode()
+    and then by FastAPI encoder.
+    """
+    return Response(content=json_encode_dumps(value), media_type="application/json")
+
+
 def create_server():
     import sqlite3
 
@@ -194,7 +203,7 @@ def create_server():
                 as_list,
                 distinct,
             )
-        return json_encode(result)
+        return json_response(result)
 
     @app.get("/count")
     async def count(
@@ -205,6 +214,24 @@ def create_server():
         async with async_lock:
             return storage_api.count(connection_id, str_to_json(path), query)
 
+    @app.get("/aggregate")
+    async def aggregate(
+        connection_id: query_str,
+        path: query_path,
+        query: Annotated[str | None, Query()] = None,
+        group_by: Annotated[list[str] | None, Query()] = None,
+        metrics: query_json = None,
+    ):
+        async with async_lock:
+            result = storage_api.aggregate(
+                connection_id,
+                str_to_json(path),
+                query,
+                group_by=group_by,
+                metrics=(None if metrics is None else json.loads(metrics)),
+            )
+            return json_response(result)
+
     @app.get("/primary_key")
     async def primary_key(connection_id: query_str, path: query_path):
         async with async_lock:
@@ -238,12 +265,23 @@ def create_server():
         fields: Annotated[list[str] | None, Query()] = None,
         as_list: query_bool = False,
         distinct: query_bool = False,
+        order_by: Annotated[list[str] | None, Query()] = None,
+        limit: Annotated[int | None, Query()] = None,
+        after: query_json = None,
     ):
         async with async_lock:
             result = storage_api.search(
-                connection_id, str_to_json(path), query, fields, as_list, distinct
+                connection_id,
+                str_to_json(path),
+                query,
+                fields,
+                as_list,
+                distinct,
+                order_by=order_by,
+                limit=limit,
+                after=(None if after is None else json_decode(json.loads(after))),
             )
-            return json_encode(result)
+            return json_response(result)
 
     @app.delete("/search")
     async def search_and_delete(
@@ -264,7 +302,7 @@ def create_server():
             result = storage_api.distinct_values(
                 connection_id, str_to_json(path), field
             )
-            return json_encode(result)
+            return json_response(list(result))
 
     @app.delete("/")
     async def clear_database(
@@ -21,6 +21,7 @@ class Storage:
         create: bool = False,
         echo_sql: typing.TextIO | None = None,
         secret: str | None = None,
+        wal: bool = False,
     ):
         if isinstance(database_file, pathlib.Path):
             database_file = str(database_file)
@@ -30,6 +31,7 @@ class Storage:
             create=create,
             echo_sql=echo_sql,
             secret=secret,
+            wal=wal,
         )
         self._read_access_token = None
         self._write_access_token = None
@@ -325,13 +327,47 @@ class StorageSession:
     def count(self, query=None):
         return self._storage_api.count(self._connection_id, self._path, query=query)
 
+    def aggregate(self, query=None, group_by=None, metrics=None):
+        """
+        Compute aggregate values (count, sum, min, max or avg) on the
+        documents selected by query, grouped by the values of group_by
+        fields. See
+        :py:meth:`populse_db.database.DatabaseCollection.aggregate`.
+        """
+        if isinstance(group_by, tuple):
+            group_by = list(group_by)
+        return self._storage_api.aggregate(
+            self._connection_id,
+            self._path,
+            query=query,
+            group_by=group_by,
+            metrics=metrics,
+        )
+
     def append(self, value):
         return self._storage_api.append(self._connection_id, self._path, value)
 
     def distinct_values(self, field):
         return self._storage_api.distinct_values(self._connection_id, self._path, field)
 
-    def search(self, query=None, fields=None, as_list=None, distinct=False, **kwargs):
+    def search(
+        self,
+        query=None,
+        fields=None,
+        as_list=None,
+        distinct=False,
+        order_by=None,
+        limit=None,
+        after=None,
+        **kwargs,
+    ):
+        """
+        Return the list of documents selected by query. order_by, limit
+        and after allow to retrieve a sorted result page by page (see
+        :py:meth:`populse_db.database.DatabaseCollection.filter`). The
+        last document of a page can be given as after to get the next
+        page.
+        """
         if kwargs and query:
             raise ValueError("Cannot combine query and equality research")
         if kwargs:
@@ -345,6 +381,40 @@ class StorageSession:
             fields=fields,
             as_list=as_list,
             distinct=distinct,
+            order_by=order_by,
+            limit=limit,
+            after=after,
+        )
+
+    def iter_search(
+        self,
+        query=None,
+        fields=None,
+        as_list=None,
+        distinct=False,
+        batch_size=1000,
+        **kwargs,
+    ):
+        """
+        Like search() but returns an iterator over lists of at most
+        batch_size documents instead of a single list. With a local
+        database file, documents are read from the database as the
+        iterator is consumed.
+        """
+        if kwargs and query:
+            raise ValueError("Cannot combine query and equality research")
+        if kwargs:
+            query = " AND ".join(f'{{{k}}}=="{v}"' for k, v in kwargs.items())
+        if isinstance(fields, tuple):
+            fields = list(fields)
+        return self._storage_api.iter_search(
+            self._connection_id,
+            self._path,
+            query,
+            fields=fields,
+            as_list=as_list,
+            distinct=distinct,
+            batch_size=batch_size,
         )
 
     def search_and_delete(self, query=None, **kwargs):
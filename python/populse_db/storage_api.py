@@ -9,7 +9,11 @@ import requests
 from cryptography.fernet import Fernet, InvalidToken
 
 import populse_db.storage
-from populse_db.database import json_decode, json_encode, str_to_type
+from populse_db.database import (
+    json_encode,
+    json_loads_decode,
+    str_to_type,
+)
 
 from . import Database
 from .database import populse_db_table
@@ -79,6 +83,7 @@ class StorageAPI:
         create: bool = False,
         echo_sql: typing.TextIO | None = None,
         secret: str | None = None,
+        wal: bool = False,
     ):
         if database_file.startswith("server:"):
             database_file = database_file[7:]
@@ -90,11 +95,11 @@ class StorageAPI:
                 storage = StorageServerAPI(database_file, secret=secret)
             else:
                 storage = StorageFileAPI(
-                    database_file, timeout, create, echo_sql, secret=secret
+                    database_file, timeout, create, echo_sql, secret=secret, wal=wal
                 )
         else:
             storage = StorageFileAPI(
-                database_file, timeout, create, echo_sql, secret=secret
+                database_file, timeout, create, echo_sql, secret=secret, wal=wal
             )
         return storage
 
@@ -191,10 +196,15 @@ class StorageFileAPI(BaseStorageAPI):
         create: bool = False,
         echo_sql: typing.TextIO | None = None,
         secret: str | None = None,
+        wal: bool = False,
     ):
         super().__init__(database_file=database_file, secret=secret)
         self.database = Database(
-            self.database_file, timeout=timeout, create=create, echo_sql=echo_sql
+            self.database_file,
+            timeout=timeout,
+            create=create,
+            echo_sql=echo_sql,
+            wal=wal,
         )
         self.sessions = {}
         self.lock = threading.Lock()
@@ -256,6 +266,8 @@ class StorageFileAPI(BaseStorageAPI):
             # Write access must be in an exclusive transaction to avoid
             # "Database is locked" error in SQLite with parallel accesses:
             # https://www2.sqlite.org/cvstrac/wiki?p=DatabaseIsLocked
+            # In WAL mode, this is a BEGIN IMMEDIATE transaction that
+            # does not prevent readers to access the database.
             dbs = self.database.session(exclusive=True, create=create)
         else:
             raise PermissionError("database access refused")
@@ -481,6 +493,13 @@ class StorageFileAPI(BaseStorageAPI):
                 query = document_query
         return collection.count(query)
 
+    def aggregate(self, connection_id, path, query=None, group_by=None, metrics=None):
+        dbs = self._get_database_session(connection_id, write=False)
+        collection, document_id, field, path = self._parse_path(dbs, path)
+        if path or field or document_id:
+            raise ValueError("only collections can be aggregated")
+        return collection.aggregate(query, group_by=group_by, metrics=metrics)
+
     def primary_key(self, connection_id, path):
         dbs = self._get_database_session(connection_id, write=False)
         collection, document_id, field, path = self._parse_path(dbs, path)
@@ -513,8 +532,7 @@ class StorageFileAPI(BaseStorageAPI):
             collection[document_id] = value
         else:
             collection.delete(None)
-            for document in value:
-                collection.add(document)
+            collection.add_many(value)
 
     def delete(self, connection_id, path):
         dbs = self._get_database_session(connection_id, write=True)
@@ -576,7 +594,16 @@ class StorageFileAPI(BaseStorageAPI):
             collection.add(value)
 
     def search(
-        self, connection_id, path, query, fields=None, as_list=None, distinct=False
+        self,
+        connection_id,
+        path,
+        query,
+        fields=None,
+        as_list=None,
+        distinct=False,
+        order_by=None,
+        limit=None,
+        after=None,
     ):
         dbs = self._get_database_session(connection_id, write=False)
         collection, document_id, field, path = self._parse_path(dbs, path)
@@ -594,10 +621,45 @@ class StorageFileAPI(BaseStorageAPI):
             else:
                 query = document_query
         result = list(
-            collection.filter(query, fields=fields, as_list=as_list, distinct=distinct)
+            collection.filter(
+                query,
+                fields=fields,
+                as_list=as_list,
+                distinct=distinct,
+                order_by=order_by,
+                limit=limit,
+                after=after,
+            )
         )
         return result
 
+    def iter_search(
+        self,
+        connection_id,
+        path,
+        query,
+        fields=None,
+        as_list=None,
+        distinct=False,
+        batch_size=1000,
+    ):
+        """
+        Like search() but yields the result in lists of at most batch_size
+        documents. Documents are read from the database as the result is
+        iterated.
+        """
+        dbs = self._get_database_session(connection_id, write=False)
+        collection, document_id, field, path = self._parse_path(dbs, path)
+        if path or field or document_id:
+            raise ValueError("only collections can be searched")
+        yield from collection.filter_batches(
+            query,
+            fields=fields,
+            as_list=as_list,
+            distinct=distinct,
+            batch_size=batch_size,
+        )
+
     def search_and_delete(self, connection_id, path, query):
         dbs = self._get_database_session(connection_id, write=False)
         collection, document_id, field, path = self._parse_path(dbs, path)
@@ -720,10 +782,9 @@ class StorageServerAPI(BaseStorageAPI):
             exc = deserialize_exception(response.json())
             raise exc
         response.raise_for_status()
-        result = response.json()
         if decode:
-            result = json_decode(result)
-        return result
+            return json_loads_decode(response.text)
+        return response.json()
 
     def access_token(self, write):
         challenge = self.get_access_challenge(write=write) or ""
@@ -842,6 +903,25 @@ class StorageServerAPI(BaseStorageAPI):
             dict(connection_id=connection_id, path=path, query=query),
         )
 
+    def aggregate(self, connection_id, path, query=None, group_by=None, metrics=None):
+        path = json_to_str(path)
+        if isinstance(group_by, str):
+            group_by = [group_by]
+        if metrics is not None:
+            metrics = json.dumps(metrics)
+        return self._call(
+            "get",
+            "aggregate",
+            {
+                "connection_id": connection_id,
+                "path": path,
+                "query": query,
+                "group_by": group_by,
+                "metrics": metrics,
+            },
+            decode=True,
+        )
+
     def primary_key(self, connection_id, path):
         path = json_to_str(path)
         return self._call(
@@ -877,9 +957,22 @@ class StorageServerAPI(BaseStorageAPI):
         )
 
     def search(
-        self, connection_id, path, query, fields=None, as_list=None, distinct=False
+        self,
+        connection_id,
+        path,
+        query,
+        fields=None,
+        as_list=None,
+        distinct=False,
+        order_by=None,
+        limit=None,
+        after=None,
     ):
         path = json_to_str(path)
+        if isinstance(order_by, str):
+            order_by = [order_by]
+        if after is not None:
+            after = json.dumps(json_encode(after))
         return self._call(
             "get",
             "search",
@@ -890,10 +983,54 @@ class StorageServerAPI(BaseStorageAPI):
                 fields=fields,
                 as_list=as_list,
                 distinct=distinct,
+                order_by=order_by,
+                limit=limit,
+                after=after,
             ),
             decode=True,
         )
 
+    def iter_search(
+        self,
+        connection_id,
+        path,
+        query,
+        fields=None,
+        as_list=None,
+        distinct=False,
+        batch_size=1000,
+    ):
+        if not fields and not as_list and not distinct:
+            # Whole documents contain primary key fields, they can be
+            # used as keyset cursor to retrieve the result page by page.
+            # Only primary key values are sent to the server.
+            primary_key = None
+            after = None
+            while True:
+                result = self.search(
+                    connection_id, path, query, limit=batch_size, after=after
+                )
+                if result:
+                    yield result
+                if len(result) < batch_size:
+                    break
+                if primary_key is None:
+                    primary_key = self.primary_key(connection_id, path)
+                after = [result[-1][i] for i in primary_key]
+            return
+        # The server does not stream results, the whole result is
+        # transferred and then split in batches.
+        result = self.search(
+            connection_id,
+            path,
+            query,
+            fields=fields,
+            as_list=as_list,
+            distinct=distinct,
+        )
+        for i in range(0, len(result), batch_size):
+            yield result[i : i + batch_size]
+
     def search_and_delete(self, connection_id, path, query):
         return self._call(
             "delete",
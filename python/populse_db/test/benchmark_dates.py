@@ -0,0 +1,89 @@
+"""
+Measure the time needed to read a collection containing date, time and
+datetime values, stored in columns and in catchall field, with the
+dateutil based parsing used by previous versions and with the current
+fromisoformat() based parsing.
+
+Usage: python -m populse_db.test.benchmark_dates [number of documents]
+"""
+
+import os
+import sqlite3
+import sys
+import tempfile
+from datetime import datetime, timedelta
+from time import perf_counter
+
+import dateutil.parser
+
+import populse_db.database
+from populse_db import Database
+from populse_db.database import parse_date, parse_datetime, parse_time
+
+
+def scan(db, repeat=3):
+    best = None
+    for _ in range(repeat):
+        with db as dbs:
+            start = perf_counter()
+            for _ in dbs["dates"].documents():
+                pass
+            duration = perf_counter() - start
+        if best is None or duration < best:
+            best = duration
+    return best
+
+
+def use_dateutil(enable):
+    if enable:
+        converters = {
+            "datetime": lambda s: dateutil.parser.parse(s),
+            "date": lambda s: dateutil.parser.parse(s).date(),
+            "time": lambda s: dateutil.parser.parse(s).time(),
+        }
+    else:
+        converters = {
+            "datetime": parse_datetime,
+            "date": parse_date,
+            "time": parse_time,
+        }
+    for name, converter in converters.items():
+        sqlite3.register_converter(name, converter)
+    populse_db.database._json_decodings.update(converters)
+
+
+def main(count):
+    with tempfile.TemporaryDirectory() as tmp:
+        db = Database(os.path.join(tmp, "dates.db"), create=True)
+        with db as dbs:
+            dbs.add_collection("dates", "id")
+            collection = dbs["dates"]
+            collection.add_field("datetime", datetime)
+            collection.add_field("date", "date")
+            collection.add_field("time", "time")
+            origin = datetime(2024, 1, 1, 12, 30, 15, 123456)
+            collection.add_many(
+                {
+                    "id": str(i),
+                    "datetime": origin + timedelta(seconds=i),
+                    "date": (origin + timedelta(days=i)).date(),
+                    "time": (origin + timedelta(seconds=i)).time(),
+                    "acquisition": origin - timedelta(minutes=i),
+                    "history": [origin + timedelta(hours=j) for j in range(3)],
+                }
+                for i in range(count)
+            )
+        try:
+            use_dateutil(True)
+            slow = scan(db)
+        finally:
+            use_dateutil(False)
+        fast = scan(db)
+    print(f"{count} documents with 7 date values each")
+    print(f"dateutil:      {slow:.3f} s")
+    print(f"fromisoformat: {fast:.3f} s")
+    print(f"speed-up:      {slow / fast:.1f}x")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 20000)
@@ -1,17 +1,47 @@
+import json
 import os
 import shutil
 import tempfile
 import unittest
 from datetime import date, datetime, time
 
+from lark.exceptions import VisitError
+
 from populse_db import Database
-from populse_db.database import check_value_type, populse_db_table
+from populse_db.database import (
+    LazyDocument,
+    check_value_type,
+    json_encode,
+    json_encode_dumps,
+    json_loads,
+    json_loads_decode,
+    parse_date,
+    parse_datetime,
+    parse_time,
+    populse_db_table,
+)
 
 # from populse_db.engine.sqlite import SQLiteSession
+from populse_db.engine.sqlite import WorkloadRecorder, _metadata_cache
 from populse_db.filter import FilterToSQL, literal_parser
 
 
 class TestsSQLiteInMemory(unittest.TestCase):
+    def test_catchall_usage(self):
+        """
+        Tests that in-memory databases do not share catchall fields usage
+        """
+        collections = []
+        for _ in range(2):
+            db = Database("sqlite://:memory:", create=True)
+            with db as dbs:
+                dbs.add_collection("test", "index")
+                collection = dbs["test"]
+                list(collection.filter('{subject} == "s1"'))
+                self.assertEqual(collection.catchall_usage, {"subject": 1})
+                collections.append(collection)
+        self.assertIsNot(collections[0].catchall_usage, collections[1].catchall_usage)
+
     def test_add_get_document(self):
         now = datetime.now()
         db = Database("sqlite://:memory:", create=True)
@@ -697,6 +727,55 @@ def create_test_case(**database_creation_parameters):
                 doc.update({"status": "running", "other": "something"})
                 self.assertEqual(collection["doc"], doc)
 
+        def test_update_documents(self):
+            """
+            Tests the method updating all documents selected by a filter
+            """
+            database = self.create_database()
+            with database as session:
+                session.add_collection("collection")
+                collection = session["collection"]
+                collection.add_field("status", str)
+                collection.add_field("index", int)
+                collection.add_many(
+                    {
+                        "primary_key": f"doc{i}",
+                        "status": "submitted",
+                        "index": i,
+                        "label": "old",
+                    }
+                    for i in range(10)
+                )
+                modified = collection.update_documents(
+                    "{index} >= 5", {"status": "running", "label": "new"}
+                )
+                self.assertEqual(modified, 5)
+                for document in collection.documents():
+                    if document["index"] >= 5:
+                        self.assertEqual(document["status"], "running")
+                        self.assertEqual(document["label"], "new")
+                    else:
+                        self.assertEqual(document["status"], "submitted")
+                        self.assertEqual(document["label"], "old")
+                self.assertEqual(collection.count('{label} == "new"'), 5)
+                self.assertEqual(collection.update_documents(None, {"other": 1}), 10)
+                self.assertEqual(collection.count("{other} == 1"), 10)
+                # Catchall keys are not JSON paths
+                self.assertEqual(
+                    collection.update_documents(
+                        "{index} == 1", {"k.y": 10, "a b": 11, 'q"x': 12}
+                    ),
+                    1,
+                )
+                document = collection["doc1"]
+                self.assertEqual(
+                    [document["k.y"], document["a b"], document['q"x']], [10, 11, 12]
+                )
+                self.assertNotIn("k", document)
+                self.assertEqual(collection.count("{k.y} == 10"), 1)
+                with self.assertRaises(ValueError):
+                    collection.update_documents(None, {"primary_key": "x"})
+
         def test_get_document(self):
             """
             Tests the method giving the document row given a document
@@ -728,6 +807,1056 @@ def create_test_case(**database_creation_parameters):
                 self.assertIsNone(session.get_document("collection1", None))
                 self.assertIsNone(session.get_document("collection1", 1))
 
+        def test_documents_by_ids(self):
+            """
+            Tests the method getting several documents given their keys
+            """
+            database = self.create_database()
+            with database as session:
+                session.add_collection("single", "name")
+                session.add_collection(
+                    "snapshots",
+                    {"subject": str, "time_point": str, "number": int},
+                )
+                session.add_collection("days", {"day": date})
+                session["days"].add({"day": date(2020, 1, 1), "value": 1})
+                session["days"].add({"day": date(2020, 1, 2), "value": 2})
+                session["single"].add_field("value", int)
+                session["single"].add_many(
+                    {"name": f"doc{i}", "value": i} for i in range(1000)
+                )
+                session["snapshots"].add_many(
+                    {
+                        "subject": f"s{i}",
+                        "time_point": f"M{i % 3}",
+                        "number": i % 2,
+                        "value": i,
+                    }
+                    for i in range(1000)
+                )
+                for limit in (1000, 1):
+                    single = session["single"]
+                    snapshots = session["snapshots"]
+                    days = session["days"]
+                    single.documents_by_ids_in_limit = limit
+                    snapshots.documents_by_ids_in_limit = limit
+                    days.documents_by_ids_in_limit = limit
+
+                    ids = [f"doc{i}" for i in range(994, -1, -7)] + ["missing"]
+                    values = [i["value"] for i in single.documents_by_ids(iter(ids))]
+                    self.assertEqual(values, list(range(994, -1, -7)))
+                    # Documents are returned in the order of ids
+                    self.assertEqual(
+                        list(
+                            single.documents_by_ids(
+                                ["doc7", "doc3", "missing", "doc5", "doc3"],
+                                fields=["value"],
+                                as_list=True,
+                            )
+                        ),
+                        [[7], [3], [5], [3]],
+                    )
+                    self.assertEqual(
+                        list(
+                            single.documents_by_ids(["doc2", "doc1"], fields=["value"])
+                        ),
+                        [{"value": 2}, {"value": 1}],
+                    )
+
+                    ids = [(f"s{i}", f"M{i % 3}", i % 2) for i in range(999, -1, -3)]
+                    ids.append(("s1", "M0", 0))
+                    documents = list(snapshots.documents_by_ids(ids))
+                    self.assertEqual(
+                        [i["value"] for i in documents],
+                        list(range(999, -1, -3)),
+                    )
+                    self.assertEqual(list(snapshots.documents_by_ids([])), [])
+
+                    # Keys are converted as in document()
+                    self.assertEqual(
+                        [
+                            i["value"]
+                            for i in snapshots.documents_by_ids(
+                                [("s5", "M2", "1"), ("s4", "M1", 0)]
+                            )
+                        ],
+                        [5, 4],
+                    )
+                    self.assertEqual(
+                        [
+                            i["value"]
+                            for i in days.documents_by_ids(
+                                ["2020-01-02", date(2020, 1, 1), "2020-01-02"]
+                            )
+                        ],
+                        [2, 1, 2],
+                    )
+
+        def test_columns(self):
+            """
+            Tests columnar results of filter() and documents()
+            """
+            try:
+                import numpy
+            except ImportError:
+                self.skipTest("numpy is not installed")
+            database = self.create_database()
+            with database as session:
+                session.add_collection("collection", "name")
+                collection = session["collection"]
+                collection.add_field("i", int)
+                collection.add_field("f", float)
+                collection.add_field("b", bool)
+                collection.add_field("d", date)
+                collection.add_field("dt", datetime)
+                collection.add_field("l", list[int])
+                collection.add_many(
+                    {
+                        "name": f"doc{i}",
+                        "i": i,
+                        "f": (i / 2 if i != 3 else None),
+                        "b": bool(i % 2),
+                        "d": date(2024, 1, i + 1),
+                        "dt": (datetime(2024, 1, 1, i) if i != 2 else None),
+                        "l": [i, i],
+                        "other": i * 10,
+                    }
+                    for i in range(5)
+                )
+                fields = ["name", "i", "f", "b", "d", "dt", "l", "other"]
+                columns = collection.filter("{i} > 0", fields=fields, as_columns=True)
+                self.assertEqual(list(columns), fields)
+                self.assertEqual(columns["i"].dtype, numpy.int64)
+                self.assertEqual(columns["i"].tolist(), [1, 2, 3, 4])
+                self.assertEqual(columns["f"].dtype, numpy.float64)
+                self.assertTrue(numpy.isnan(columns["f"][2]))
+                self.assertEqual(columns["b"].tolist(), [True, False, True, False])
+                self.assertEqual(columns["d"].dtype, numpy.dtype("datetime64[D]"))
+                self.assertEqual(
+                    columns["d"][0], numpy.datetime64(date(2024, 1, 2), "D")
+                )
+                self.assertTrue(numpy.isnat(columns["dt"][1]))
+                self.assertEqual(columns["l"].dtype, object)
+                self.assertEqual(columns["l"][0], [1, 1])
+                self.assertEqual(columns["other"].tolist(), [10, 20, 30, 40])
+
+                collection.add({"name": "none"})
+                columns = collection.documents(fields=["i", "b"], as_columns=True)
+                self.assertEqual(columns["i"].dtype, object)
+                self.assertIsNone(columns["i"][-1])
+                self.assertRaises(ValueError, collection.documents, as_columns=True)
+
+        def test_lazy_documents(self):
+            """
+            Tests documents whose catchall fields are decoded on access
+            """
+            database = self.create_database()
+            with database as session:
+                session.add_collection("collection", "name")
+                collection = session["collection"]
+                collection.add_field("value", int)
+                collection.add(
+                    {"name": "doc", "value": 1, "other": {"a": [1, 2]}, "s": "x"}
+                )
+                collection.add({"name": "empty", "value": 2})
+                document = collection.document("doc", lazy=True)
+                self.assertIsInstance(document, LazyDocument)
+                self.assertIsNone(document._document)
+                self.assertEqual(document["value"], 1)
+                self.assertIn("name", document)
+                self.assertIsNone(document._document)
+                self.assertEqual(document["other"], {"a": [1, 2]})
+                self.assertEqual(document.get("missing"), None)
+                self.assertEqual(dict(document), collection.document("doc"))
+                self.assertEqual(
+                    list(collection.filter("{value} == 2", lazy=True)),
+                    [{"name": "empty", "value": 2}],
+                )
+                self.assertEqual(
+                    sorted(len(i) for i in collection.documents(lazy=True)),
+                    [2, 4],
+                )
+                self.assertEqual(
+                    list(collection.documents(fields=["s"], lazy=True)),
+                    [{"s": "x"}, {"s": None}],
+                )
+
+        def test_pagination(self):
+            """
+            Tests keyset pagination with order_by, limit and after
+            """
+            database = self.create_database()
+            with database as session:
+                session.add_collection("collection", "name")
+                collection = session["collection"]
+                collection.add_field("value", int)
+                collection.add_field("label", str)
+                collection.add_many(
+                    {
+                        "name": f"doc{i:02}",
+                        "value": (None if i % 5 == 0 else i % 4),
+                        "label": (None if i % 7 == 0 else f"l{i % 3}"),
+                        "other": i % 6,
+                    }
+                    for i in range(30)
+                )
+                all_documents = list(collection.documents())
+
+                def sorted_documents(documents, order_by):
+                    # Stable sorts from the last sort key to the first one
+                    # with NULL values lower than any other value
+                    descending = order_by[-1].startswith("-")
+                    result = sorted(
+                        documents, key=lambda d: d["name"], reverse=descending
+                    )
+                    for field in reversed(order_by):
+                        descending = field.startswith("-")
+                        field = field.lstrip("-")
+                        result.sort(
+                            key=lambda d, f=field: (d[f] is not None, d[f] or 0),
+                            reverse=descending,
+                        )
+                    return result
+
+                for order_by in (
+                    ["value"],
+                    ["label", "value"],
+                    ["-value"],
+                    ["-value", "label"],
+                    ["other", "-value"],
+                ):
+                    pages = []
+                    after = None
+                    while True:
+                        page = list(
+                            collection.filter(
+                                '{name} != "doc03"',
+                                order_by=order_by,
+                                limit=7,
+                                after=after,
+                            )
+                        )
+                        pages.append(page)
+                        if len(page) < 7:
+                            break
+                        after = page[-1]
+                    result = [i for page in pages for i in page]
+                    self.assertEqual(len(result), 29)
+                    self.assertEqual(
+                        list(collection.filter('{name} != "doc03"', order_by=order_by)),
+                        result,
+                    )
+                    if "label" not in order_by:
+                        expected = sorted_documents(
+                            (i for i in all_documents if i["name"] != "doc03"),
+                            order_by,
+                        )
+                        self.assertEqual(result, expected)
+
+                self.assertEqual(
+                    [
+                        i["name"]
+                        for i in collection.filter(
+                            None, order_by="-name", limit=2, after=["doc10"]
+                        )
+                    ],
+                    ["doc09", "doc08"],
+                )
+                self.assertEqual(
+                    list(
+                        collection.filter(
+                            None,
+                            fields=["value"],
+                            as_list=True,
+                            distinct=True,
+                            order_by="value",
+                        )
+                    ),
+                    [[None], [0], [1], [2], [3]],
+                )
+                self.assertRaises(
+                    ValueError,
+                    collection.filter,
+                    None,
+                    order_by="value",
+                    after=[1],
+                )
+                # Documents selected with a fields list can be used as
+                # cursor only if they contain sort and primary key fields
+                page = list(
+                    collection.filter(
+                        None, fields=["name", "value"], order_by="value", limit=5
+                    )
+                )
+                self.assertEqual(
+                    list(
+                        collection.filter(
+                            None,
+                            fields=["name", "value"],
+                            order_by="value",
+                            limit=5,
+                            after=page[-1],
+                        )
+                    ),
+                    [
+                        {k: d[k] for k in ("name", "value")}
+                        for d in sorted_documents(all_documents, ["value"])[5:10]
+                    ],
+                )
+                page = list(
+                    collection.filter(None, fields=["name"], order_by="value", limit=5)
+                )
+                self.assertRaises(
+                    ValueError,
+                    collection.filter,
+                    None,
+                    fields=["name"],
+                    order_by="value",
+                    limit=5,
+                    after=page[-1],
+                )
+
+        def test_aggregate(self):
+            """
+            Tests aggregate values computed by the database
+            """
+            database = self.create_database()
+            with database as session:
+                session.add_collection("collection", "name")
+                collection = session["collection"]
+                collection.add_field("subject", str)
+                collection.add_field("date", date)
+                collection.add_field("valid", bool)
+                collection.add_many(
+                    {
+                        "name": f"doc{i}",
+                        "subject": f"s{i % 3}",
+                        "date": date(2024, 1, 1 + i),
+                        "valid": i % 3 == 0,
+                        "size": i,
+                    }
+                    for i in range(10)
+                )
+                self.assertEqual(collection.aggregate(), [{"count": 10}])
+                self.assertEqual(
+                    collection.aggregate(
+                        "{size} > 2",
+                        group_by="subject",
+                        metrics={
+                            "n": "count",
+                            "first": ("min", "date"),
+                            "last": ("max", "date"),
+                            "total": ("sum", "size"),
+                            "mean": ("avg", "size"),
+                        },
+                    ),
+                    [
+                        {
+                            "subject": "s0",
+                            "n": 3,
+                            "first": date(2024, 1, 4),
+                            "last": date(2024, 1, 10),
+                            "total": 18,
+                            "mean": 6.0,
+                        },
+                        {
+                            "subject": "s1",
+                            "n": 2,
+                            "first": date(2024, 1, 5),
+                            "last": date(2024, 1, 8),
+                            "total": 11,
+                            "mean": 5.5,
+                        },
+                        {
+                            "subject": "s2",
+                            "n": 2,
+                            "first": date(2024, 1, 6),
+                            "last": date(2024, 1, 9),
+                            "total": 13,
+                            "mean": 6.5,
+                        },
+                    ],
+                )
+                self.assertEqual(
+                    collection.aggregate(
+                        group_by=["valid"], metrics={"size": ("max", "size")}
+                    ),
+                    [{"valid": False, "size": 8}, {"valid": True, "size": 9}],
+                )
+                # Values of group columns are converted only once
+                self.assertEqual(
+                    collection.aggregate(
+                        "{size} < 2",
+                        group_by="date",
+                        metrics={"last": ("max", "date")},
+                    ),
+                    [
+                        {"date": date(2024, 1, 1), "last": date(2024, 1, 1)},
+                        {"date": date(2024, 1, 2), "last": date(2024, 1, 2)},
+                    ],
+                )
+                self.assertRaises(
+                    ValueError, collection.aggregate, metrics={"x": ("median", "size")}
+                )
+                self.assertRaises(
+                    ValueError, collection.aggregate, metrics={"x": "sum"}
+                )
+
+        def test_add_index(self):
+            """
+            Tests indexes on column and catchall fields
+            """
+            database = self.create_database()
+            with database as session:
+                session.add_collection("collection", "name")
+                collection = session["collection"]
+                collection.add_field("value", int)
+                collection.add_many(
+                    {"name": f"doc{i}", "value": i, "subject": f"s{i % 10}"}
+                    for i in range(100)
+                )
+                collection.add_index("value")
+                collection.add_index("subject")
+                collection.add_index("subject")
+                self.assertTrue(collection.fields["value"]["index"])
+                self.assertEqual(collection.catchall_indexes, {"subject"})
+                self.assertEqual(collection.settings()["catchall_indexes"], ["subject"])
+                where = collection.parse_filter('{subject} == "s3"')
+                plan = " ".join(
+                    row[-1]
+                    for row in session.execute(
+                        f"EXPLAIN QUERY PLAN SELECT * FROM [collection] WHERE {where}",
+                        where.parameters,
+                    )
+                )
+                self.assertIn("collection__catchall_subject", plan)
+                self.assertEqual(
+                    sorted(i["value"] for i in collection.filter('{subject} == "s3"')),
+                    list(range(3, 100, 10)),
+                )
+            with self.create_database(clear=False) as session:
+                self.assertEqual(session["collection"].catchall_indexes, {"subject"})
+
+        def test_promote_catchall_field(self):
+            """
+            Tests moving catchall fields to columns
+            """
+            database = self.create_database()
+            with database as session:
+                session.add_collection("collection", "name")
+                collection = session["collection"]
+                collection.promotion_batch_size = 7
+                collection.add_many(
+                    {
+                        "name": f"doc{i}",
+                        "subject": f"s{i % 3}",
+                        "size": (i if i % 2 else i / 2),
+                        "tags": [f"t{i}"],
+                        "mixed": ([i] if i % 2 else "x"),
+                        "flag": i % 2 == 0,
+                    }
+                    for i in range(20)
+                )
+                collection.add({"name": "empty"})
+                collection.add_index("subject")
+                documents = list(collection.documents())
+
+                collection.catchall_usage.clear()
+                list(collection.filter('{subject} == "s1"'))
+                list(collection.filter('{subject} == "s1"'))
+                list(collection.documents(fields=["size", "tags"]))
+                self.assertEqual(
+                    collection.catchall_usage, {"subject": 2, "size": 1, "tags": 1}
+                )
+                self.assertEqual(collection.promote_catchall_fields(2), ["subject"])
+                self.assertEqual(collection.fields["subject"]["type"], str)
+                self.assertTrue(collection.fields["subject"]["index"])
+                self.assertEqual(collection.catchall_indexes, set())
+                for field in ("size", "tags", "flag"):
+                    collection.promote_catchall_field(field)
+                self.assertRaises(
+                    ValueError, collection.promote_catchall_field, "mixed"
+                )
+                collection.promote_catchall_field("mixed", list)
+                self.assertEqual(collection.fields["size"]["type"], float)
+                self.assertEqual(collection.fields["tags"]["type"], list[str])
+                self.assertEqual(collection.fields["flag"]["type"], bool)
+                self.assertRaises(
+                    ValueError, collection.promote_catchall_field, "subject"
+                )
+                self.assertRaises(
+                    ValueError, collection.promote_catchall_field, "missing"
+                )
+                self.assertEqual(
+                    sorted(collection.documents(), key=lambda d: d["name"]),
+                    sorted(
+                        (
+                            {
+                                k: d.get(k)
+                                for k in (
+                                    "name",
+                                    "subject",
+                                    "size",
+                                    "tags",
+                                    "mixed",
+                                    "flag",
+                                )
+                            }
+                            for d in documents
+                        ),
+                        key=lambda d: d["name"],
+                    ),
+                )
+                self.assertEqual(
+                    session.execute(
+                        "SELECT DISTINCT _catchall FROM [collection]"
+                    ).fetchall(),
+                    [("{}",)],
+                )
+                collection.add({"name": "new", "subject": "s9"})
+                self.assertEqual(
+                    session.execute(
+                        "SELECT subject FROM [collection] WHERE name='new'"
+                    ).fetchone()[0],
+                    "s9",
+                )
+            # Usage is shared by sessions opening the same file with
+            # different paths
+            path = self.database_url[len("sqlite://") :]
+            with Database(os.path.relpath(path)) as session:
+                self.assertIs(
+                    session["collection"].catchall_usage, collection.catchall_usage
+                )
+
+        def test_advise_indexes(self):
+            """
+            Tests index advices built from recorded requests
+            """
+            database = self.create_database()
+            with database as session:
+                session.add_collection("collection", "name")
+                collection = session["collection"]
+                collection.add_field("value", int)
+                collection.add_field("indexed", int, index=True)
+                collection.add_many(
+                    {
+                        "name": f"doc{i}",
+                        "value": i,
+                        "indexed": i,
+                        "subject": f"s{i % 10}",
+                    }
+                    for i in range(1000)
+                )
+                recorder = WorkloadRecorder(slow_threshold=0)
+                session.workload = recorder
+                for i in range(3):
+                    list(collection.filter(f"{{value}} > {i}"))
+                list(collection.filter('{subject} == "s1" and {value} < 10'))
+                list(collection.filter("{indexed} == 3"))
+                self.assertEqual(collection.count("{value} > 0"), 999)
+                session.workload = None
+                self.assertTrue(all(i["time"] > 0 for i in recorder.queries.values()))
+                advice = {
+                    tuple(i["fields"]): i for i in session.advise_indexes(recorder)
+                }
+                self.assertEqual(set(advice), {("value",), ("subject", "value")})
+                self.assertEqual(advice[("value",)]["kind"], "single")
+                self.assertEqual(advice[("value",)]["queries"], 4)
+                self.assertEqual(advice[("subject", "value")]["kind"], "composite")
+                session.execute(advice[("subject", "value")]["sql"])
+                recorder.clear()
+                session.workload = recorder
+                # The new index can be used
+                list(collection.filter('{subject} == "s1"'))
+                list(collection.filter('{tag} == "t"'))
+                session.workload = None
+                advice = session.advise_indexes(recorder)
+                self.assertEqual([i["fields"] for i in advice], [["tag"]])
+                self.assertEqual(advice[0]["kind"], "expression")
+                # Single field advice creates the same index as add_index()
+                collection.add_index("tag")
+                self.assertEqual(
+                    session.execute(
+                        "SELECT sql FROM sqlite_master WHERE type='index' AND name=?",
+                        ["collection__catchall_tag"],
+                    ).fetchone()[0],
+                    advice[0]["sql"].replace("IF NOT EXISTS ", ""),
+                )
+                # Requests on removed collections are ignored
+                session.remove_collection("collection")
+                self.assertEqual(session.advise_indexes(recorder), [])
+
+        def test_element_index(self):
+            """
+            Tests index on the elements of list fields
+            """
+            database = self.create_database()
+            with database as session:
+                session.add_collection("collection", ["subject", "time_point"])
+                collection = session["collection"]
+                collection.add_field("tags", list[str])
+                collection.add_field("other", int)
+                collection.add_many(
+                    {
+                        "subject": f"s{i}",
+                        "time_point": "M0",
+                        "tags": (None if i == 0 else [f"t{i % 3}", "all", "all"]),
+                    }
+                    for i in range(10)
+                )
+                self.assertRaises(ValueError, collection.add_element_index, "other")
+
+                def names(filter):
+                    return sorted(
+                        i["subject"]
+                        for i in collection.filter(filter, fields=["subject"])
+                    )
+
+                filters = [
+                    '"t1" IN {tags}',
+                    '"all" IN {tags} AND NOT "t2" IN {tags}',
+                    '"none" IN {tags}',
+                ]
+                expected = [names(i) for i in filters]
+                collection.add_element_index("tags")
+                self.assertIn(
+                    "populse_db_elements_collection_tags",
+                    collection.parse_filter(filters[0]),
+                )
+                self.assertEqual([names(i) for i in filters], expected)
+                self.assertEqual([i.name for i in session], ["collection"])
+
+                collection.add({"subject": "new", "time_point": "M0", "tags": ["t1"]})
+                collection["s1", "M0"] = {"tags": ["t2"]}
+                collection.update_document(("s4", "M0"), {"tags": ["x"]})
+                del collection["s7", "M0"]
+                self.assertEqual(names('"t1" IN {tags}'), ["new"])
+                self.assertEqual(names('"x" IN {tags}'), ["s4"])
+                self.assertEqual(
+                    session.execute(
+                        "SELECT COUNT(*) FROM [populse_db_elements_collection_tags]"
+                    ).fetchone()[0],
+                    15,
+                )
+                collection.remove_field("tags")
+                self.assertEqual(collection.element_indexes, set())
+                session.remove_collection("collection")
+
+        def test_text_index(self):
+            """
+            Tests full text search with the MATCH operator
+            """
+            database = self.create_database()
+            with database as session:
+                session.add_collection("collection", "name")
+                collection = session["collection"]
+                collection.add_field("file_name", str)
+                collection.add_field("description", str)
+                collection.add_many(
+                    {
+                        "name": f"doc{i}",
+                        "file_name": f"/data/sub{i}/G{i % 3}_run{i}.nii",
+                        "description": f"scan number {i}",
+                    }
+                    for i in range(10)
+                )
+                # Lark wraps the ValueError raised by FilterToSQL
+                self.assertRaises(
+                    VisitError, collection.parse_filter, '{file_name} MATCH "g1_"'
+                )
+                self.assertRaises(ValueError, collection.add_text_index, "missing")
+                collection.add_text_index("file_name")
+                collection.add_text_index("description", tokenizer="unicode61")
+
+                def names(filter):
+                    return sorted(
+                        i["name"] for i in collection.filter(filter, fields=["name"])
+                    )
+
+                self.assertEqual(
+                    names('{file_name} MATCH "g1_"'), ["doc1", "doc4", "doc7"]
+                )
+                self.assertEqual(
+                    names('{file_name} MATCH "g1_" AND {description} MATCH "4"'),
+                    ["doc4"],
+                )
+                # The searched text is a phrase, not an FTS5 query
+                collection.add({"name": "dash", "file_name": "/data/sub-01/t1.nii.gz"})
+                self.assertEqual(names('{file_name} MATCH "sub-01"'), ["dash"])
+                self.assertEqual(names('{file_name} MATCH "run1.nii"'), ["doc1"])
+                self.assertEqual(len(names('{file_name} MATCH "/sub"')), 11)
+                self.assertEqual(names('{file_name} MATCH "nii gz"'), [])
+                self.assertEqual(names('{file_name} MATCH "run4 nii"'), [])
+                del collection["dash"]
+                self.assertEqual([i.name for i in session], ["collection"])
+
+                collection["doc1"] = {"file_name": "other"}
+                collection.update_document("doc4", {"file_name": "none"})
+                del collection["doc7"]
+                collection.add({"name": "new", "file_name": "G1_new"})
+                self.assertEqual(names('{file_name} MATCH "g1_"'), ["new"])
+                collection.remove_field("description")
+                self.assertEqual(list(collection.text_indexes), ["file_name"])
+            with self.create_database(clear=False) as session:
+                self.assertEqual(
+                    session["collection"].text_indexes, {"file_name": "trigram"}
+                )
+                # A collection created before the prefix of internal tables
+                # was reserved
+                session.execute(
+                    f"CREATE TABLE [{populse_db_table}_legacy] "
+                    "(name TEXT NOT NULL, _catchall dict, PRIMARY KEY (name))"
+                )
+            with self.create_database(clear=False) as session:
+                self.assertEqual(
+                    sorted(i.name for i in session),
+                    ["collection", f"{populse_db_table}_legacy"],
+                )
+                self.assertTrue(session.has_collection(f"{populse_db_table}_legacy"))
+                session.clear()
+                self.assertEqual(
+                    session.execute("SELECT name FROM sqlite_master").fetchall(), []
+                )
+
+        def test_wal(self):
+            """
+            Tests that readers are not blocked by a writer in WAL mode
+            """
+            self.create_database()
+            db = Database(
+                **self.database_creation_parameters, wal=True, wal_autocheckpoint=0
+            )
+            writer = db.session(exclusive=True)
+            try:
+                self.assertEqual(
+                    writer.execute("PRAGMA journal_mode").fetchone()[0], "wal"
+                )
+                writer.add_collection("collection", "name")
+                writer.commit()
+                writer["collection"]["doc1"] = {}
+                reader = db.session()
+                try:
+                    # The uncommitted document is not visible but the
+                    # reader does not wait for the writer
+                    self.assertEqual(reader["collection"].count(), 0)
+                    writer.commit()
+                    reader.commit()
+                    self.assertEqual(reader["collection"].count(), 1)
+                finally:
+                    reader.close()
+                busy, log, checkpointed = writer.checkpoint("truncate")
+                self.assertEqual((busy, log, checkpointed), (0, 0, 0))
+                self.assertRaises(ValueError, writer.checkpoint, "other")
+            finally:
+                writer.close()
+
+        def test_session_pool(self):
+            """
+            Tests the reuse of sessions by a Database with a pool
+            """
+            self.create_database()
+            db = Database(**self.database_creation_parameters, pool_size=1)
+            with db as session:
+                session.add_collection("collection", "name")
+            with db as session2:
+                self.assertIs(session2, session)
+                self.assertEqual([i.name for i in session2], ["collection"])
+            with db.exclusive as session2:
+                self.assertIs(session2, session)
+                self.assertTrue(session2.exclusive)
+
+            # Rolled back changes must not remain in reused session
+            try:
+                with db as session2:
+                    session2.add_collection("rolled_back", "name")
+                    raise ZeroDivisionError()
+            except ZeroDivisionError:
+                pass
+            with db as session2:
+                self.assertIs(session2, session)
+                self.assertFalse(session2.has_collection("rolled_back"))
+
+            # Schema modifications from other connections are seen
+            with self.create_database(clear=False) as other:
+                other.add_collection("other", "name")
+            with db as session2:
+                self.assertIs(session2, session)
+                self.assertTrue(session2.has_collection("other"))
+
+            # Schema modifications committed by another connection while a
+            # session is in use are seen when the session is reused
+            wal_db = Database(
+                **self.database_creation_parameters, pool_size=1, wal=True
+            )
+            with wal_db as reader:
+                reader["collection"]["doc"] = {}
+            with wal_db as reader:
+                self.assertEqual(list(reader["collection"].fields), ["name"])
+                with self.create_database(clear=False) as other:
+                    other["collection"].add_field("x", int)
+                    other["collection"]["doc"] = {"x": 5}
+            with wal_db as reader2:
+                self.assertIs(reader2, reader)
+                self.assertEqual(list(reader2["collection"].fields), ["name", "x"])
+                self.assertEqual(reader2["collection"]["doc"], {"name": "doc", "x": 5})
+                self.assertEqual(reader2["collection"].count("{x} == 5"), 1)
+            wal_db.clear_pool()
+            # Metadata shared with other sessions is up to date
+            with self.create_database(clear=False) as other:
+                self.assertEqual(list(other["collection"].fields), ["name", "x"])
+
+            # Idle sessions are closed after the timeout
+            db.pool_idle_timeout = 0
+            with db as session2:
+                self.assertIsNot(session2, session)
+            db.clear_pool()
+            self.assertEqual(db._pool, [])
+
+        def test_metadata_cache(self):
+            """
+            Tests the sharing of collections metadata between sessions
+            """
+            with self.create_database() as session:
+                session.add_collection("collection", "name")
+                session["collection"].add_field("field", str)
+            with self.create_database(clear=False) as session:
+                collection = session["collection"]
+                self.assertEqual(list(collection.fields), ["name", "field"])
+                key = session._metadata_key
+            self.assertIsNotNone(_metadata_cache[key][1]["collection"])
+            with self.create_database(clear=False) as session:
+                self.assertEqual(
+                    session["collection"].metadata(), collection.metadata()
+                )
+                # Modifying settings only must invalidate the cache
+                settings = session["collection"].settings()
+                settings["fields"]["field"]["description"] = "modified"
+                session["collection"].set_settings(settings)
+            with self.create_database(clear=False) as session:
+                self.assertEqual(
+                    session["collection"].fields["field"]["description"], "modified"
+                )
+            # Uncommitted modifications are not shared
+            try:
+                with self.create_database(clear=False) as session:
+                    session["collection"].add_field("other", int)
+                    session.add_collection("rolled_back", "name")
+                    session["rolled_back"]
+                    raise ZeroDivisionError()
+            except ZeroDivisionError:
+                pass
+            with self.create_database(clear=False) as session:
+                self.assertEqual(list(session["collection"].fields), ["name", "field"])
+                self.assertFalse(session.has_collection("rolled_back"))
+                session.remove_collection("collection")
+                session.add_collection("collection", "other_name")
+                self.assertEqual(list(session["collection"].fields), ["other_name"])
+
+        def test_parse_dates(self):
+            """
+            Tests the parsing of dates written by populse_db or not
+            """
+            d = datetime(2018, 5, 23, 12, 41, 33, 540)
+            self.assertEqual(parse_datetime(d.isoformat()), d)
+            self.assertEqual(parse_datetime(d.isoformat().encode()), d)
+            self.assertEqual(
+                parse_datetime("May 23 2018 12:41"), d.replace(second=0, microsecond=0)
+            )
+            self.assertEqual(parse_date(d.date().isoformat()), d.date())
+            self.assertEqual(parse_date(b"2018-05-23T12:41:33"), d.date())
+            self.assertEqual(parse_time(d.time().isoformat()), d.time())
+            self.assertEqual(parse_time("12:41:33.000540+02:00"), d.time())
+            self.assertEqual(parse_time("12:41:33.00054 PM"), d.time())
+
+        def test_json_codec(self):
+            """
+            Tests single pass JSON encoding and decoding of tagged values
+            """
+            d = datetime(2018, 5, 23, 12, 41, 33, 540)
+            values = [
+                {"a": 1, "b": "text", "c": [1.5, None, True]},
+                {"d": d, "l": [d.date(), [d.time(), {"n": d}]], "s": "ℹ"},
+                [d, {"x": [d]}],
+                d,
+                "plain",
+            ]
+            for value in values:
+                text = json_encode_dumps(value)
+                self.assertEqual(text, json.dumps(json_encode(value)))
+                self.assertEqual(json_loads_decode(text), value)
+                self.assertEqual(
+                    json_loads_decode(
+                        json.dumps(json_encode(value), ensure_ascii=False)
+                    ),
+                    value,
+                )
+            self.assertRaises(TypeError, json_encode_dumps, {"x": object()})
+
+            # Values that are not supported by all JSON libraries
+            for text in (
+                "[NaN, Infinity]",
+                "[-9223372036854775809, 123456789012345678901234567890]",
+            ):
+                self.assertEqual(repr(json_loads(text)), repr(json.loads(text)))
+            self.assertRaises(ValueError, json_loads, "{invalid")
+
+        def test_packed_list(self):
+            """
+            Tests list fields stored as packed binary arrays
+            """
+            with self.create_database() as session:
+                session.add_collection("collection", "name")
+                collection = session["collection"]
+                collection.add_field("top", list[int], packed=True)
+                collection.add_field("size", list[float], packed=True)
+                collection.add_field("plain", list[int])
+                self.assertRaises(
+                    ValueError, collection.add_field, "bad", list[str], packed=True
+                )
+                for i in range(5):
+                    collection[f"doc{i}"] = {
+                        "top": [i, 2**40, -i],
+                        "size": [i / 2, 1.5],
+                        "plain": [i, 2**40, -i],
+                    }
+                collection["empty"] = {"top": [], "size": None, "plain": []}
+                collection["none"] = {"top": None, "plain": None}
+                self.assertRaises(
+                    ValueError, collection.add, {"name": "bad", "top": [1.5]}
+                )
+                self.assertIsInstance(
+                    session.execute(
+                        "SELECT top FROM collection WHERE name='doc1'"
+                    ).fetchone()[0],
+                    bytes,
+                )
+                self.assertEqual(
+                    collection["doc3"],
+                    {
+                        "name": "doc3",
+                        "top": [3, 2**40, -3],
+                        "size": [1.5, 1.5],
+                        "plain": [3, 2**40, -3],
+                    },
+                )
+                self.assertEqual(collection["empty"]["top"], [])
+                self.assertIsNone(collection["empty"]["size"])
+                # Filters have the same results on packed and JSON fields
+                for packed, plain in (
+                    ("-2 IN {top}", "-2 IN {plain}"),
+                    (
+                        "{top} == [4, 1099511627776, -4]",
+                        "{plain} == [4, 1099511627776, -4]",
+                    ),
+                    ("{top} == null", "{plain} == null"),
+                ):
+                    self.assertEqual(
+                        [i["name"] for i in collection.filter(packed)],
+                        [i["name"] for i in collection.filter(plain)],
+                    )
+                self.assertEqual(
+                    [i["name"] for i in collection.filter("1.5 IN {size}")],
+                    [f"doc{i}" for i in range(5)],
+                )
+                collection.update_document("doc1", {"top": [7], "plain": [7]})
+                self.assertEqual(collection["doc1"]["top"], [7])
+                self.assertRaises(ValueError, collection.add_element_index, "top")
+
+                # Aggregation and paging use the JSON value of packed fields
+                def rename(rows):
+                    return [
+                        {k.replace("plain", "top"): v for k, v in i.items()}
+                        for i in rows
+                    ]
+
+                self.assertEqual(
+                    collection.aggregate(group_by="top"),
+                    rename(collection.aggregate(group_by="plain")),
+                )
+                self.assertEqual(
+                    collection.aggregate(metrics={"m": ("max", "top")}),
+                    collection.aggregate(metrics={"m": ("max", "plain")}),
+                )
+                for field in ("top", "plain"):
+                    page = list(collection.filter(None, order_by=field, limit=3))
+                    page += collection.filter(
+                        None, order_by=field, limit=3, after=page[-1]
+                    )
+                    self.assertEqual(
+                        [i["name"] for i in page],
+                        ["none", "doc0", "doc2", "doc3", "doc4", "doc1"],
+                    )
+
+                # Compiled filters are not shared with a collection having
+                # the same fields but not packed
+                other_db = Database(
+                    "sqlite://" + os.path.join(self.temp_folder, "other.db"),
+                    create=True,
+                )
+                with other_db as other:
+                    other.add_collection("collection", "name")
+                    other["collection"].add_field("top", list[int])
+                    other["collection"].add_field("size", list[float])
+                    other["collection"].add_field("plain", list[int])
+                    other["collection"]["doc"] = {"top": [3]}
+                    self.assertEqual(
+                        [i["name"] for i in other["collection"].filter("3 IN {top}")],
+                        ["doc"],
+                    )
+                self.assertEqual(
+                    [i["name"] for i in collection.filter("3 IN {top}")], ["doc3"]
+                )
+            with self.create_database(clear=False) as session:
+                self.assertTrue(session["collection"].fields["top"]["packed"])
+                self.assertEqual(session["collection"]["doc1"]["top"], [7])
+
+        def test_ndarray_field(self):
+            """
+            Tests fields containing NumPy arrays
+            """
+            try:
+                import numpy
+            except ImportError:
+                self.skipTest("numpy is not installed")
+            transform = numpy.arange(16, dtype=numpy.float32).reshape(4, 4)
+            histogram = numpy.array([3, 0, 7], dtype=numpy.uint16)
+            with self.create_database() as session:
+                session.add_collection("collection", "name")
+                collection = session["collection"]
+                collection.add_field("transform", "ndarray")
+                self.assertIs(collection.fields["transform"]["type"], numpy.ndarray)
+                collection["doc1"] = {
+                    "transform": transform.T,
+                    "histogram": histogram,
+                    "scalar": numpy.array(1.5),
+                }
+                collection["doc2"] = {"transform": None, "empty": numpy.zeros((0, 3))}
+                self.assertRaises(
+                    ValueError,
+                    collection.add,
+                    {"name": "bad", "transform": numpy.array([{}])},
+                )
+                # Array values in catchall create ndarray fields
+                self.assertIs(collection.fields["histogram"]["type"], numpy.ndarray)
+                self.assertNotIn("histogram", collection.bad_json_fields)
+            with self.create_database(clear=False) as session:
+                collection = session["collection"]
+                doc = collection["doc1"]
+                self.assertEqual(doc["transform"].dtype, numpy.float32)
+                numpy.testing.assert_array_equal(doc["transform"], transform.T)
+                numpy.testing.assert_array_equal(doc["histogram"], histogram)
+                self.assertEqual(doc["histogram"].dtype, numpy.uint16)
+                self.assertEqual(doc["scalar"].shape, ())
+                self.assertEqual(doc["scalar"], 1.5)
+                self.assertFalse(doc["transform"].flags.writeable)
+                doc = collection["doc2"]
+                self.assertIsNone(doc["transform"])
+                self.assertEqual(doc["empty"].shape, (0, 3))
+                self.assertEqual(
+                    [i["name"] for i in collection.filter("{transform} == null")],
+                    ["doc2"],
+                )
+
         def test_remove_document(self):
             """
             Tests the method removing a document
@@ -833,6 +1962,49 @@ def create_test_case(**database_creation_parameters):
                 with self.assertRaises(session.database_exceptions):
                     session.add_document("collection1", document)
 
+        def test_add_many(self):
+            """
+            Tests the method adding several documents at once
+            """
+            now = datetime.now()
+            database = self.create_database()
+            with database as session:
+                session.add_collection("collection1", "name")
+                session.add_field("collection1", "List", list[int])
+                session.add_field("collection1", "Int", int)
+                documents = [
+                    {"name": "document1", "List": [1, 2, 3], "Int": 5},
+                    {"name": "document2", "Int": 6},
+                    {"name": "document3", "Int": 7, "other": "value"},
+                    {"name": "document4", "List": [4], "date": now},
+                    {"name": "document5", "List": [5], "Int": 8},
+                ]
+                collection = session["collection1"]
+                collection.add_many(iter(documents))
+                self.assertEqual(collection.count(), 5)
+                self.assertIn("date", collection.fields)
+                for document in documents:
+                    stored = {
+                        k: v
+                        for k, v in collection[document["name"]].items()
+                        if v is not None
+                    }
+                    self.assertEqual(stored, document)
+                self.assertEqual(
+                    [i[0] for i in collection.documents(fields=["name"], as_list=True)],
+                    [i["name"] for i in documents],
+                )
+
+                with self.assertRaises(session.database_exceptions):
+                    collection.add_many([{"name": "document1", "Int": 0}])
+                collection.add_many(
+                    [{"name": "document1", "Int": 0}, {"name": "document6"}],
+                    replace=True,
+                )
+                self.assertEqual(collection["document1"]["Int"], 0)
+                self.assertIsNone(collection["document1"]["List"])
+                self.assertEqual(collection.count(), 6)
+
         def test_add_collection(self):
             """
             Tests the method adding a collection
@@ -868,6 +2040,12 @@ def create_test_case(**database_creation_parameters):
                     session.database_exceptions,
                     lambda: session.add_collection(populse_db_table),
                 )
+                # Names reserved for internal tables
+                self.assertRaises(
+                    ValueError,
+                    session.add_collection,
+                    f"{populse_db_table}_collection",
+                )
 
                 # Trying with wrong types
                 self.assertRaises(
@@ -1049,6 +2227,25 @@ def create_test_case(**database_creation_parameters):
                 documents2 = list(session.get_documents("collection2"))
                 self.assertEqual(len(documents2), 2)
 
+                # Documents are returned in the order of document_ids
+                self.assertEqual(
+                    list(
+                        session.get_documents(
+                            "collection1",
+                            fields=["name"],
+                            as_list=True,
+                            document_ids=["document2", "document1"],
+                        )
+                    ),
+                    [["document2"], ["document1"]],
+                )
+                session.add_collection("ints", {"id": int})
+                session["ints"][5] = {}
+                self.assertEqual(
+                    list(session.get_documents("ints", document_ids=[5, "5"])),
+                    [{"id": 5}, {"id": 5}],
+                )
+
                 # Testing with a collection not existing
                 self.assertEqual(
                     list(session.get_documents("collection_not_existing")), []
@@ -1844,6 +3041,77 @@ def create_test_case(**database_creation_parameters):
                                 f"Error while testing filter : {tested_filter}"
                             ) from e
 
+        def test_filter_cache(self):
+            """
+            Tests the process wide cache of compiled filters
+            """
+            from populse_db.engine.sqlite import parsed_filter_cache
+
+            database = self.create_database()
+            with database as session:
+                session.add_collection("collection1", "name")
+                collection = session["collection1"]
+                collection.add_many(
+                    {"name": str(i), "value": i % 3, "other": i} for i in range(9)
+                )
+                parsed_filter_cache.clear()
+                for _i in range(3):
+                    self.assertEqual(collection.count("{value} == 1"), 3)
+                self.assertEqual(parsed_filter_cache.hits, 2)
+                self.assertEqual(parsed_filter_cache.misses, 1)
+                self.assertIn("json_extract", collection.parse_filter("{value} == 1"))
+
+                collection.add_field("value", int)
+                self.assertNotIn(
+                    "json_extract", collection.parse_filter("{value} == 1")
+                )
+                self.assertEqual(parsed_filter_cache.misses, 2)
+                self.assertEqual(collection.count("{value} == 1"), 0)
+                collection.update_documents("{other} < 4", {"value": 1})
+                self.assertEqual(collection.count("{value} == 1"), 4)
+
+            # Another session on the same collection reuses compiled filters
+            hits = parsed_filter_cache.hits
+            with database as session:
+                session["collection1"].parse_filter("{other} < 4")
+                self.assertEqual(parsed_filter_cache.hits, hits + 1)
+
+        def test_filter_parameters(self):
+            """
+            Tests filter literals given to SQLite as request parameters
+            """
+            database = self.create_database()
+            with database as session:
+                session.add_collection("collection1", "name")
+                collection = session["collection1"]
+                collection.add_field("date", date)
+                collection.add_field("strings", list[str])
+                collection.add_many(
+                    {
+                        "name": f"it's {i}",
+                        "date": date(2020, 1, i + 1),
+                        "strings": [str(i), "x"],
+                    }
+                    for i in range(5)
+                )
+                filter_1 = collection.parse_filter('{name} == "it\'s 1"')
+                filter_2 = collection.parse_filter('{name} == "it\'s 2"')
+                self.assertEqual(filter_1, filter_2)
+                self.assertEqual(filter_1.parameters, ("it's 1",))
+                self.assertEqual(filter_2.parameters, ("it's 2",))
+                self.assertEqual(
+                    [i["name"] for i in collection.filter(filter_2)], ["it's 2"]
+                )
+                self.assertEqual(collection.count("{date} >= 2020-01-04"), 2)
+                self.assertEqual(
+                    collection.count('"3" IN {strings} OR {name} IN ["it\'s 0"]'), 2
+                )
+                self.assertEqual(collection.count('{strings} == ["4", "x"]'), 1)
+                self.assertEqual(
+                    collection.delete('{date} < 2020-01-03 AND "x" IN {strings}'), 2
+                )
+                self.assertEqual(collection.count(), 3)
+
         def test_modify_list_field(self):
             database = self.create_database()
             with database as session:
@@ -6,6 +6,7 @@ from tempfile import TemporaryDirectory
 
 import pytest
 
+import populse_db
 from populse_db import Storage
 from populse_db.storage import SchemaSession
 
@@ -334,6 +335,41 @@ def run_storage_tests(store):
             time_point="M0", as_list=True, fields=["data_type"], distinct=True
         ) == [["greywhite"]]
 
+        # Search in a collection by batches
+        batches = list(d.snapshots.iter_search(batch_size=3))
+        assert [len(i) for i in batches] == [3, 1]
+        assert sorted(
+            (doc for batch in batches for doc in batch), key=lambda doc: doc["image"]
+        ) == sorted(d.snapshots.search(), key=lambda doc: doc["image"])
+        batches = list(
+            d.snapshots.iter_search(
+                fields=["subject"], as_list=True, batch_size=2, time_point="M0"
+            )
+        )
+        assert [len(i) for i in batches] == [2, 1]
+        assert {row[0] for batch in batches for row in batch} == {
+            "0001292COG",
+            "0001017COG",
+            "0001235COG",
+        }
+
+        # Search page by page
+        ordered = d.snapshots.search(order_by="-image")
+        assert [doc["image"] for doc in ordered] == sorted(
+            (doc["image"] for doc in snapshots), reverse=True
+        )
+        page = d.snapshots.search(order_by="-image", limit=3)
+        assert page == ordered[:3]
+        assert (
+            d.snapshots.search(order_by="-image", limit=3, after=page[-1])
+            == (ordered[3:])
+        )
+
+        # Aggregate values
+        assert d.snapshots.aggregate(
+            group_by="time_point", metrics={"count": "count"}
+        ) == [{"time_point": "M0", "count": 3}, {"time_point": "first", "count": 1}]
+
         # Count elements
         assert d.snapshots.count() == 4
         assert d.snapshots.count('image LIKE "/home/yann%"') == 3
@@ -479,14 +515,26 @@ def test_storage_server():
     with TemporaryDirectory() as tmp:
         tmp_path = os.path.join(tmp, "test_populse.sqlite")
         cmd = [sys.executable, "-m", "populse_db.server", "-v", tmp_path]
+        # The server must use the tested populse_db package
+        env = os.environ.copy()
+        env["PYTHONPATH"] = os.pathsep.join(
+            i
+            for i in (
+                os.path.dirname(os.path.dirname(populse_db.__file__)),
+                env.get("PYTHONPATH"),
+            )
+            if i
+        )
         server = subprocess.Popen(
-            cmd, stderr=subprocess.DEVNULL, stdout=subprocess.DEVNULL
+            cmd, stderr=subprocess.DEVNULL, stdout=subprocess.DEVNULL, env=env
         )
 
         try:
             store = Storage(f"server:{tmp_path}", echo_sql=sys.stdout)
             run_storage_tests(store)
             os.chmod(tmp_path, 0o500)
+            if os.access(tmp_path, os.W_OK):
+                pytest.skip("read-only database file is writable (running as root?)")
             store = Storage(f"server:{tmp_path}")
             with pytest.raises(PermissionError):
                 run_storage_tests(store)